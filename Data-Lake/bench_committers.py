@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from urllib.request import urlopen
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, lit, pmod, sha2
+from committers import COMMITTERS, committer_settings, spark_packages
+from metrics import RunMetrics
+from writer import TABLE_LAYOUTS, DEFAULT_MAX_RECORDS_PER_FILE, write_table
+
+
+def create_bench_session(args):
+    """
+    Creates a spark session writing to the S3 compatible store at args.endpoint through the S3A committer protocol.
+    The committer itself is picked per write, so a single session compares all of them.
+    """
+    builder = SparkSession.builder.appName("bench_committers") \
+        .config("spark.jars.packages", spark_packages("directory", args.hadoop_aws_version, args.hadoop_cloud_package)) \
+        .config("spark.hadoop.fs.s3a.access.key", args.access_key) \
+        .config("spark.hadoop.fs.s3a.secret.key", args.secret_key)
+    for key, value in committer_settings("directory", "replace", args.endpoint, True).items():
+        builder = builder.config(key, value)
+    return builder.getOrCreate()
+
+
+def create_bucket(args):
+    """
+    Creates the benchmark bucket on the local store when it does not exist yet.
+    """
+    import boto3
+    s3 = boto3.client(
+        "s3", endpoint_url=args.endpoint, aws_access_key_id=args.access_key, aws_secret_access_key=args.secret_key
+    )
+    if args.bucket not in [bucket["Name"] for bucket in s3.list_buckets()["Buckets"]]:
+        s3.create_bucket(Bucket=args.bucket)
+
+
+def synthetic_table(spark, rows, layout):
+    """
+    Builds rows of fake data with the partition and sort columns of a table layout:
+    two years and twelve months of partitions, like the songplays and time tables, and the user_bucket of users.
+    """
+    df = spark.range(rows)
+    for column in layout["partition_by"] + layout["sort_by"]:
+        if column == "year":
+            df = df.withColumn(column, lit(2018) + col("id") % 2)
+        elif column == "month":
+            df = df.withColumn(column, lit(1) + col("id") % 12)
+        elif column == "user_bucket":
+            df = df.withColumn(column, pmod(col("id"), lit(layout["buckets"])))
+        else:
+            df = df.withColumn(column, col("id") * 7919 % rows)
+    return df.withColumn("payload", sha2(col("id").cast("string"), 256))
+
+
+def job_completion(spark, job_ids):
+    """
+    Returns the epoch time when the last of the given jobs finished its tasks, from the spark monitoring REST API.
+    Output committers commit the job on the driver after that, so the gap to the end of the write is the commit time.
+    """
+    sc = spark.sparkContext
+    completed = []
+    for job_id in job_ids:
+        url = "{}/api/v1/applications/{}/jobs/{}".format(sc.uiWebUrl, sc.applicationId, job_id)
+        job = json.load(urlopen(url, timeout=10))
+        if job.get("completionTime"):
+            finished = datetime.strptime(job["completionTime"].replace("GMT", ""), "%Y-%m-%dT%H:%M:%S.%f")
+            completed.append(finished.replace(tzinfo=timezone.utc).timestamp())
+    return max(completed) if completed else None
+
+
+def main():
+    """
+    - Creates a spark session pointing s3a at a local S3 compatible store (MinIO, moto server, ...)
+
+    - Writes a synthetic version of every lake table with each committer
+
+    - Prints and appends to --results the write and commit time of every table and committer
+    """
+    parser = argparse.ArgumentParser(description="Compares S3A output committers on a local S3 compatible store")
+    parser.add_argument("--endpoint", default="http://localhost:9000")
+    parser.add_argument("--access-key", default="minioadmin")
+    parser.add_argument("--secret-key", default="minioadmin")
+    parser.add_argument("--bucket", default="sparkify-bench")
+    parser.add_argument("--create-bucket", action="store_true", help="create the bucket with boto3")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--committers", nargs="+", default=COMMITTERS, choices=COMMITTERS)
+    parser.add_argument("--hadoop-aws-version", default="3.3.4")
+    parser.add_argument("--hadoop-cloud-package", default="org.apache.spark:spark-hadoop-cloud_2.12:3.3.2")
+    parser.add_argument("--results", default="reports/bench_committers.jsonl")
+    args = parser.parse_args()
+
+    if args.create_bucket:
+        create_bucket(args)
+
+    spark = create_bench_session(args)
+    hadoop_conf = spark.sparkContext._jsc.hadoopConfiguration()
+    metrics = RunMetrics(spark)
+
+    results = []
+    for committer in args.committers:
+        hadoop_conf.set("fs.s3a.committer.name", committer)
+        hadoop_conf.set("fs.s3a.committer.magic.enabled", str(committer == "magic").lower())
+        for table, layout in TABLE_LAYOUTS.items():
+            layout = dict(layout, max_records_per_file=DEFAULT_MAX_RECORDS_PER_FILE)
+            df = synthetic_table(spark, args.rows, layout)
+            path = "s3a://{}/{}/{}.parquet".format(args.bucket, committer, table)
+            with metrics.stage("{}_{}".format(committer, table), "write") as stage:
+                write_table(df, path, layout)
+            finished = time.time()
+
+            tasks_done = job_completion(spark, stage["job_ids"])
+            results.append({
+                "committer": committer,
+                "table": table,
+                "rows": args.rows,
+                "write_seconds": stage["wall_seconds"],
+                "commit_seconds": round(finished - tasks_done, 3) if tasks_done else None,
+            })
+
+    print("{:<12} {:<12} {:>14} {:>15}".format("committer", "table", "write (s)", "commit (s)"))
+    if os.path.dirname(args.results):
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as f:
+        for result in results:
+            print("{:<12} {:<12} {:>14} {:>15}".format(
+                result["committer"], result["table"], result["write_seconds"], result["commit_seconds"]))
+            f.write(json.dumps(result) + "\n")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
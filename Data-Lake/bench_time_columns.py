@@ -0,0 +1,61 @@
+import argparse
+import time
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import lit, rand
+from time_columns import TIME_ENGINES, add_time_columns
+
+
+# 2018-01-01 and 2019-01-01 in epoch milliseconds
+TS_START = 1514764800000
+TS_END = 1546300800000
+
+
+def create_events(spark, rows):
+    """
+    Builds a DataFrame with rows random epoch millisecond timestamps inside 2018, like the ts column of log_data.
+    """
+    return spark.range(rows).select(
+        (lit(TS_START) + rand(seed=42) * (TS_END - TS_START)).cast("long").alias("ts")
+    )
+
+
+def run_engine(events, engine):
+    """
+    Derives the time columns with the given engine and forces full evaluation through the noop sink,
+    returning the elapsed wall time in seconds.
+    """
+    start = time.time()
+    add_time_columns(events, "ts", engine=engine).write.format("noop").mode("overwrite").save()
+    return time.time() - start
+
+
+def main():
+    """
+    - Creates a spark session
+
+    - Generates and caches random events
+
+    - Runs each time engine over the events and prints its cost per million rows
+    """
+    parser = argparse.ArgumentParser(description="Compares time column derivation engines")
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engines", nargs="+", default=list(TIME_ENGINES))
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.appName("bench_time_columns").getOrCreate()
+    events = create_events(spark, args.rows).cache()
+    events.count()
+
+    print("{:<8} {:>12} {:>16}".format("engine", "best (s)", "s / 1M rows"))
+    for engine in args.engines:
+        # the first run warms up the python workers and is not reported
+        run_engine(events, engine)
+        best = min(run_engine(events, engine) for _ in range(args.repeat))
+        print("{:<8} {:>12.3f} {:>16.3f}".format(engine, best, best / args.rows * 1000000))
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+COMMITTERS = ["file", "directory", "partitioned", "magic"]
+
+
+def committer_settings(committer, conflict_mode="fail", endpoint="", path_style_access=False):
+    """
+    Returns the spark settings that make parquet writes on s3a:// use the given output committer.
+
+    - file is hadoop's classic FileOutputCommitter, whose rename based job commit becomes a copy and delete
+      of every file on S3
+
+    - directory and partitioned are the S3A staging committers: tasks write locally and upload with multipart
+      uploads that are only completed on job commit. partitioned with conflict_mode=replace replaces only the
+      partitions written by the job, like dynamic partition overwrite
+
+    - magic writes multipart uploads straight to their final path and completes them on job commit
+
+    endpoint and path_style_access point s3a at an S3 compatible store such as a local MinIO or moto server.
+    """
+    if committer not in COMMITTERS:
+        raise ValueError("Unknown committer {}. Use one of {}".format(committer, ", ".join(COMMITTERS)))
+
+    settings = {}
+    if committer != "file":
+        settings.update({
+            "spark.hadoop.fs.s3a.committer.name": committer,
+            "spark.hadoop.fs.s3a.committer.magic.enabled": str(committer == "magic").lower(),
+            "spark.hadoop.fs.s3a.committer.staging.conflict-mode": conflict_mode,
+            "spark.sql.sources.commitProtocolClass": "org.apache.spark.internal.io.cloud.PathOutputCommitProtocol",
+            "spark.sql.parquet.output.committer.class": "org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter",
+            "spark.hadoop.mapreduce.outputcommitter.factory.scheme.s3a": "org.apache.hadoop.fs.s3a.commit.S3ACommitterFactory",
+        })
+    if endpoint:
+        settings.update({
+            "spark.hadoop.fs.s3a.endpoint": endpoint,
+            "spark.hadoop.fs.s3a.path.style.access": str(path_style_access).lower(),
+            "spark.hadoop.fs.s3a.connection.ssl.enabled": str(endpoint.startswith("https")).lower(),
+        })
+    return settings
+
+
+def check_dynamic_overwrite(committer, conflict_mode="fail"):
+    """
+    Raises an error when the committer can't replace partitions. Spark's PathOutputCommitProtocol rejects
+    dynamic partition overwrite, so on the S3A committers only partitioned with conflict_mode=replace,
+    which replaces the partitions it writes by itself, can merge the users table and run dynamic incremental writes.
+    """
+    if committer == "file" or (committer == "partitioned" and conflict_mode == "replace"):
+        return
+    raise ValueError(
+        "The {} committer with CONFLICT_MODE={} can't overwrite single partitions, which the users merge and "
+        "INCREMENTAL_WRITE=dynamic need. Use COMMITTER=file, or COMMITTER=partitioned with CONFLICT_MODE=replace".format(
+            committer, conflict_mode
+        )
+    )
+
+
+def spark_packages(committer, hadoop_aws_version, hadoop_cloud_package):
+    """
+    Returns the spark.jars.packages value: hadoop-aws, plus spark-hadoop-cloud for the S3A committers,
+    which only exist from hadoop-aws 3.1 on.
+    """
+    packages = ["org.apache.hadoop:hadoop-aws:" + hadoop_aws_version]
+    if committer != "file":
+        if hadoop_aws_version.startswith(("2.", "3.0.")):
+            raise ValueError("S3A committers need hadoop-aws 3.1 or later, HADOOP_AWS_VERSION is " + hadoop_aws_version)
+        if not hadoop_cloud_package:
+            raise ValueError("S3A committers need SPARK_HADOOP_CLOUD_PACKAGE, e.g. org.apache.spark:spark-hadoop-cloud_2.12:3.3.2")
+        packages.append(hadoop_cloud_package)
+    return ",".join(packages)
@@ -0,0 +1,124 @@
+import math
+from datetime import datetime
+from etl import config, create_spark_session, INPUT_DATA, BRONZE_DATA
+from incremental import get_filesystem, list_input_files, read_manifest, write_manifest, find_new_files, find_changed_files, update_manifest
+from schemas import song_log_schema, event_log_schema
+
+
+TARGET_FILE_MB = config.getint("COMPACTION", "TARGET_FILE_MB", fallback=128)
+# how many bytes of raw json end up as one byte of snappy parquet, used to size output files before writing
+JSON_TO_PARQUET_RATIO = config.getfloat("COMPACTION", "JSON_TO_PARQUET_RATIO", fallback=4.0)
+
+DATASETS = [
+    ("song_data", "song_data/*/*/*/*.json", song_log_schema),
+    ("log_data", "log_data/*/*/*.json", event_log_schema),
+]
+
+
+def output_file_count(raw_bytes):
+    """
+    This function returns how many parquet files raw_bytes of json should be compacted into
+    so each one is close to TARGET_FILE_MB.
+    """
+    target_bytes = TARGET_FILE_MB * 1024 * 1024 * JSON_TO_PARQUET_RATIO
+    return max(1, int(math.ceil(raw_bytes / target_bytes)))
+
+
+def remove_unlisted_batches(spark, dataset_path, batches):
+    """
+    This function deletes the batch=<id> folders under dataset_path that are not on batches: the ones replaced
+    by a newer batch, or written by a run that failed before recording them on the manifest.
+    """
+    fs, hadoop_path = get_filesystem(spark, dataset_path)
+    if not fs.exists(hadoop_path):
+        return
+    listed = set("batch=" + batch["batch_id"] for batch in batches)
+    for status in fs.listStatus(hadoop_path):
+        folder = status.getPath()
+        if status.isDirectory() and folder.getName().startswith("batch=") and folder.getName() not in listed:
+            print("removing {}".format(folder.toString()))
+            fs.delete(folder, True)
+
+
+def compact_dataset(spark, name, source, schema, bronze_data):
+    """
+    - Lists the raw json files of a dataset and keeps the ones missing from the dataset's compaction manifest
+
+    - When files changed since they were compacted, compacts again every file of the batches holding their old rows,
+      so the bronze layer keeps a single version of every file
+
+    - Reads them with the dataset schema, dropping malformed records
+
+    - Writes them as a new batch of right-sized parquet files under bronze_data/<name>/batch=<id>
+
+    - Records the compacted files and their batch on the manifest, then removes the replaced batches
+    """
+    manifest_path = bronze_data + "_manifests/{}.json".format(name)
+    dataset_path = bronze_data + name
+    manifest = read_manifest(spark, manifest_path)
+    manifest.setdefault("batches", [])
+    file_batches = manifest.setdefault("file_batches", {})
+    remove_unlisted_batches(spark, dataset_path, manifest["batches"])
+
+    input_files = list_input_files(spark, source)
+    new_files = find_new_files(input_files, manifest)
+    if not new_files:
+        print("{}: nothing to compact".format(name))
+        return
+
+    changed_files = find_changed_files(input_files, manifest)
+    untracked = [path for path in changed_files if path not in file_batches]
+    if untracked:
+        raise ValueError(
+            "{}: {} changed files were compacted before their batch was recorded, remove {} and {} to compact "
+            "the dataset again".format(name, len(untracked), dataset_path, manifest_path)
+        )
+    replaced = set(file_batches[path] for path in changed_files)
+    if replaced:
+        print("{}: {} files changed, compacting again the {} batches holding them".format(name, len(changed_files), len(replaced)))
+    # every file of a replaced batch, gone from the input or not, leaves the manifest with it
+    for path, batch_id in list(file_batches.items()):
+        if batch_id in replaced:
+            del file_batches[path]
+            manifest["files"].pop(path, None)
+            if path in input_files and path not in new_files:
+                new_files.append(path)
+    new_files = sorted(new_files)
+
+    raw_bytes = sum(input_files[path]["size"] for path in new_files)
+    num_files = output_file_count(raw_bytes)
+    batch_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    df = spark.read.json(new_files, schema=schema, mode="DROPMALFORMED")
+    df.repartition(num_files).write.parquet(
+        dataset_path + "/batch={}".format(batch_id), mode="overwrite"
+    )
+
+    manifest["batches"] = [batch for batch in manifest["batches"] if batch["batch_id"] not in replaced]
+    manifest["batches"].append({
+        "batch_id": batch_id,
+        "input_files": len(new_files),
+        "input_bytes": raw_bytes,
+        "output_files": num_files,
+    })
+    for path in new_files:
+        file_batches[path] = batch_id
+    write_manifest(spark, manifest_path, update_manifest(manifest, input_files, new_files, None))
+    remove_unlisted_batches(spark, dataset_path, manifest["batches"])
+    print("{}: compacted {} files ({} bytes) into {} parquet files".format(name, len(new_files), raw_bytes, num_files))
+
+
+def main():
+    """
+    - Creates a spark session
+
+    - Compacts the song and log json files not compacted yet into the bronze layer, which etl.py reads with READ_FROM=bronze
+    """
+    spark = create_spark_session()
+
+    for name, pattern, schema in DATASETS:
+        compact_dataset(spark, name, INPUT_DATA + pattern, schema, BRONZE_DATA)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
+import argparse
 import configparser
-from datetime import datetime
 import os
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf, col
-from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format
-from pyspark.sql.types import StructType, StructField, IntegerType, StringType, DoubleType, LongType, TimestampType
+from pyspark.sql.functions import col
+from schemas import song_log_schema, event_log_schema
+from time_columns import add_time_columns
+from incremental import list_input_files, read_manifest, write_manifest, find_new_files, find_changed_files, update_manifest, \
+    collect_file_partitions, expand_changed_files, write_partitions
+from song_lookup import build_song_lookup, join_song_lookup, lookup_exists, lookup_size
+from writer import load_layouts, write_table
+from local_etl import run as run_local, is_local, input_size
+from metrics import RunMetrics
+from scheduler import WriteScheduler
+from committers import check_dynamic_overwrite, committer_settings, spark_packages
+from users_dimension import latest_users, merge_users
 
 
 config = configparser.ConfigParser()
@@ -13,55 +23,121 @@ config.read('dl.cfg')
 os.environ['AWS_ACCESS_KEY_ID']=config.get("AWS_CREDENTIALS","AWS_ACCESS_KEY_ID")
 os.environ['AWS_SECRET_ACCESS_KEY']=config.get("AWS_CREDENTIALS","AWS_SECRET_ACCESS_KEY")
 
+TIME_ENGINE = config.get("ETL", "TIME_ENGINE", fallback="native")
+INPUT_DATA = config.get("ETL", "INPUT_DATA", fallback="s3a://udacity-dend/")
+OUTPUT_DATA = config.get("ETL", "OUTPUT_DATA", fallback="s3a://udacity-sparkify-project/")
+MODE = config.get("ETL", "MODE", fallback="full")
+INCREMENTAL_WRITE = config.get("ETL", "INCREMENTAL_WRITE", fallback="append")
+MANIFEST_PATH = config.get("ETL", "MANIFEST_PATH", fallback=OUTPUT_DATA + "_manifests/log_data.json")
+BROADCAST_THRESHOLD = config.getint("ETL", "BROADCAST_THRESHOLD_MB", fallback=64) * 1024 * 1024
+REUSE_SONG_LOOKUP = config.getboolean("ETL", "REUSE_SONG_LOOKUP", fallback=False)
+SONG_STORAGE_LEVEL = config.get("ETL", "SONG_STORAGE_LEVEL", fallback="MEMORY_AND_DISK")
+READ_FROM = config.get("ETL", "READ_FROM", fallback="raw")
+BRONZE_DATA = config.get("ETL", "BRONZE_DATA", fallback=OUTPUT_DATA + "bronze/")
+TABLE_LAYOUTS = load_layouts(config)
+ENGINE = config.get("ETL", "ENGINE", fallback="spark")
+LOCAL_ENGINE_MAX_BYTES = config.getint("ETL", "LOCAL_ENGINE_MAX_MB", fallback=512) * 1024 * 1024
+REPORT_PATH = config.get("METRICS", "REPORT_PATH", fallback="reports/run_report.json")
+PROMETHEUS_PATH = config.get("METRICS", "PROMETHEUS_PATH", fallback="") or None
+WRITE_CONCURRENCY = config.getint("ETL", "WRITE_CONCURRENCY", fallback=1)
+FAIR_ALLOCATION_FILE = config.get("ETL", "FAIR_ALLOCATION_FILE", fallback="fairscheduler.xml")
+S3A_COMMITTER = config.get("S3A", "COMMITTER", fallback="file")
+S3A_CONFLICT_MODE = config.get("S3A", "CONFLICT_MODE", fallback="fail")
+S3A_ENDPOINT = config.get("S3A", "ENDPOINT", fallback="")
+S3A_PATH_STYLE_ACCESS = config.getboolean("S3A", "PATH_STYLE_ACCESS", fallback=False)
+HADOOP_AWS_VERSION = config.get("S3A", "HADOOP_AWS_VERSION", fallback="2.7.0")
+SPARK_HADOOP_CLOUD_PACKAGE = config.get("S3A", "SPARK_HADOOP_CLOUD_PACKAGE", fallback="")
+
 def create_spark_session():
     """
-    This function creates a spark session with pre defined configurations.
+    This function creates a spark session with pre defined configurations, including the S3A output committer
+    set on the S3A section of dl.cfg.
     """
-    spark = SparkSession \
+    builder = SparkSession \
         .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
+        .config("spark.jars.packages", spark_packages(S3A_COMMITTER, HADOOP_AWS_VERSION, SPARK_HADOOP_CLOUD_PACKAGE)) \
+        .config("spark.sql.session.timeZone", "UTC")
+
+    for key, value in committer_settings(S3A_COMMITTER, S3A_CONFLICT_MODE, S3A_ENDPOINT, S3A_PATH_STYLE_ACCESS).items():
+        builder = builder.config(key, value)
+
+    # concurrent writes share the cluster through FAIR scheduler pools, one per table
+    if WRITE_CONCURRENCY > 1:
+        builder = builder.config("spark.scheduler.mode", "FAIR")
+        if os.path.exists(FAIR_ALLOCATION_FILE):
+            builder = builder.config("spark.scheduler.allocation.file", os.path.abspath(FAIR_ALLOCATION_FILE))
+
+    spark = builder.getOrCreate()
     return spark
 
-def process_song_data(spark, input_data, output_data):
+def persist(df, storage_level):
+    """
+    This function persists df with a StorageLevel name such as MEMORY_AND_DISK or DISK_ONLY. NONE leaves df as it is.
+    """
+    if storage_level == "NONE":
+        return df
+    return df.persist(getattr(StorageLevel, storage_level))
+
+def input_paths(input_data):
+    """
+    This function returns the song and log file globs of the layer set by READ_FROM: raw json under input_data
+    or the parquet files written by compact.py under BRONZE_DATA.
+    """
+    if READ_FROM == "bronze":
+        return BRONZE_DATA + "song_data/*/*.parquet", BRONZE_DATA + "log_data/*/*.parquet"
+    return input_data + "song_data/*/*/*/*.json", input_data + "log_data/*/*/*.json"
+
+def read_input(spark, paths, schema):
+    """
+    This function reads a glob or a list of files of the layer set by READ_FROM with the given schema.
+    """
+    if READ_FROM == "bronze":
+        paths = paths if isinstance(paths, list) else [paths]
+        return spark.read.schema(schema).parquet(*paths)
+    return spark.read.json(paths, schema=schema, mode="DROPMALFORMED")
+
+def process_song_data(spark, input_data, output_data, metrics, scheduler):
     """
     - Reads data from a S3 bucket's song_data folder 
+
+    - Removes duplicated records and persists the result with SONG_STORAGE_LEVEL, so the json files are scanned once
     
     - Selects some specific fields and assign it to songs_table
     
-    - Writes a parquet file containing songs_table data partioned by year and artistId on a specific S3 bucket
+    - Writes a parquet file containing songs_table data partioned by year on a specific S3 bucket
     
     - Selects some specific fields and assign it to artists_table
     
     - Writes a parquet file containing artists_table data on a specific S3 bucket
+
+    - Builds the song lookup used by the songplays join, writes it on a specific S3 bucket and loads
+      it back persisted as the result of the load_song_lookup action, the caller unpersists it once
+      the songplays table is written
+
+    - Writes are submitted to scheduler, which may run them concurrently, and the persisted records
+      are released once all of them finished
+
+    - Every read and write runs as a named stage of metrics
     """
     # get filepath to song data file
-    song_data = input_data + "song_data/*/*/*/*.json"
+    song_data, _ = input_paths(input_data)
     
-    # song schema 
-    song_log_schema = StructType([
-        StructField("num_songs",IntegerType()),
-        StructField("artist_id",StringType()),
-        StructField("artist_latitude",DoubleType()),
-        StructField("artist_longitude",DoubleType()),
-        StructField("artist_location",StringType()),
-        StructField("artist_name",StringType()),
-        StructField("song_id",StringType()),
-        StructField("title",StringType()),
-        StructField("duration",DoubleType()),
-        StructField("year",IntegerType()),
-    ])
-
-    # read song data file
-    song_data = spark.read.json(song_data, schema=song_log_schema, mode="DROPMALFORMED")
+    # read song data file, keeping parsed and deduplicated records as all tables below are derived from them
+    with metrics.stage("read_song_data", "read") as stage:
+        song_data = read_input(spark, song_data, song_log_schema)
+        song_data = persist(song_data.dropDuplicates(), SONG_STORAGE_LEVEL)
+        if SONG_STORAGE_LEVEL != "NONE":
+            stage["rows"] = song_data.count()
 
     # extract columns to create songs table
     songs_table = song_data.select(
         ["song_id", "title", "artist_id", "year", "duration"]
     ).where(song_data["song_id"].isNotNull()).dropDuplicates()
 
-    # write songs table to parquet files partitioned by year and artist
-    songs_table.write.partitionBy("year", "artist_id").parquet(output_data + "songs.parquet", mode="overwrite")
+    # write songs table to parquet files partitioned by year and sorted by artist
+    scheduler.submit("write_songs", lambda: write_table(
+        songs_table, output_data + "songs.parquet", TABLE_LAYOUTS["songs"]
+    ), pool="songs")
 
     # extract columns to create artists table
     artists_table = song_data.selectExpr([
@@ -73,17 +149,33 @@ def process_song_data(spark, input_data, output_data):
     ]).where(song_data["artist_id"].isNotNull()).dropDuplicates()
 
     # write artists table to parquet files
-    artists_table.write.parquet(output_data + "artists.parquet", mode="overwrite")
+    scheduler.submit("write_artists", lambda: write_table(
+        artists_table, output_data + "artists.parquet", TABLE_LAYOUTS["artists"]
+    ), pool="artists")
+
+    # extract keys and ids to create the song lookup
+    song_lookup = build_song_lookup(song_data)
 
-    return songs_table
+    # write song lookup to parquet files, later runs may reuse it, and load it back for the songplays join
+    def load_song_lookup():
+        write_table(song_lookup, output_data + "song_lookup.parquet", TABLE_LAYOUTS["song_lookup"])
+        return persist(spark.read.parquet(output_data + "song_lookup.parquet"), SONG_STORAGE_LEVEL)
 
-def process_log_data(spark, input_data, output_data, songs_table):
+    scheduler.submit("load_song_lookup", load_song_lookup, pool="song_lookup")
+
+    scheduler.submit(
+        "unpersist_song_data", song_data.unpersist,
+        depends_on=["write_songs", "write_artists", "load_song_lookup"], kind="cleanup"
+    )
+
+def process_log_data(spark, input_data, output_data, metrics, scheduler, log_files=None, write_mode=INCREMENTAL_WRITE,
+                     replace_partitions=None):
     """
-    - Reads data from a S3 bucket's log_data folder 
+    - Reads data from a S3 bucket's log_data folder, or only log_files when they are given (incremental mode)
     
-    - Selects some specific fields and assign it to users_table
+    - Keeps the latest state of every user and assign it to users_table
     
-    - Writes a parquet file containing users_table data on a specific S3 bucket
+    - Writes a parquet file containing users_table data partitioned by user bucket on a specific S3 bucket
     
     - Converts ts column to datetime
     
@@ -91,114 +183,210 @@ def process_log_data(spark, input_data, output_data, songs_table):
     
     - Writes a parquet file containing time_table data partitioned by year and month on a specific S3 bucket
     
-    - Joins data from log_data and songs_table and assing it to songplays_table
+    - Joins data from log_data and the song lookup loaded by the load_song_lookup action and assing it to songplays_table
     
     - Writes a parquet file containing songplays_table data partitioned by year and month on a specific S3 bucket
+
+    - In incremental mode, merges the users of the batch into the users table and writes only the
+      year/month partitions touched by log_files with write_mode, or replaces replace_partitions with them
+
+    - Writes are submitted to scheduler, songplays waits for the song lookup, the caller waits for all of them
+
+    - Every read, transform and write runs as a named stage of metrics. Reads and transforms are lazy,
+      so most of their cost is measured on the writes that consume them
     """
     # get filepath to log data file
-    log_data = input_data + "log_data/*/*/*.json"
-
-    # event schema
-    event_log_schema = StructType([
-        StructField("artist",StringType()),
-        StructField("auth",StringType()),
-        StructField("firstName",StringType()),
-        StructField("gender",StringType()),
-        StructField("itemInSession",IntegerType()),
-        StructField("lastName",StringType()),
-        StructField("length",DoubleType()),
-        StructField("level",StringType()),
-        StructField("location",StringType()),
-        StructField("method",StringType()),
-        StructField("page",StringType()),
-        StructField("registration",DoubleType()),
-        StructField("sessionId",IntegerType()),
-        StructField("song",StringType()),
-        StructField("status",IntegerType()),
-        StructField("ts",LongType()),
-        StructField("userAgent",StringType()),
-        StructField("userId",IntegerType()),
-    ])
-
-    # read log data file
-    df = spark.read.json(log_data, schema=event_log_schema, mode="DROPMALFORMED")
-
-    # filter by actions for song plays
-    df = df.filter(df.page == "NextSong")
-
-    # extract columns for users table    
-    users_table = df.select([
-        "userId",
-        "firstName",
-        "lastName",
-        "gender",
-        "level"
-    ]).where(
-        df["userId"].isNotNull()
-    ).dropDuplicates()
-
-    # write users table to parquet files
-    users_table.write.parquet(output_data + "users.parquet", mode="overwrite")
-
-    # create timestamp column from original timestamp column
-    get_timestamp = udf(lambda x: x/1000)
-    df = df.withColumn("timestamp", get_timestamp(df.ts))
-
-    # create datetime column from original timestamp column
-    get_datetime = udf(lambda x: datetime.fromtimestamp(x), TimestampType())
-    df = df.withColumn("datetime", get_datetime(df.timestamp))
-
-    get_weekday = udf(lambda x: x.weekday(), IntegerType())
-    df = df.withColumn("weekday", get_weekday(df.datetime))
+    log_data = log_files if log_files is not None else input_paths(input_data)[1]
+    incremental = log_files is not None
+
+    # read log data file and filter by actions for song plays
+    with metrics.stage("read_log_data", "read"):
+        df = read_input(spark, log_data, event_log_schema)
+        df = df.filter(df.page == "NextSong")
+
+    # extract columns for users table, keeping the attributes of the latest event of every user
+    users_table = latest_users(df, TABLE_LAYOUTS["users"]["buckets"])
+
+    # write users table to parquet files, merging only changed users in incremental mode
+    if incremental:
+        scheduler.submit("write_users", lambda: merge_users(
+            spark, users_table, output_data + "users.parquet", TABLE_LAYOUTS["users"]
+        ), pool="users")
+    else:
+        scheduler.submit("write_users", lambda: write_table(
+            users_table, output_data + "users.parquet", TABLE_LAYOUTS["users"]
+        ), pool="users")
+
+    # create datetime, hour, day, week, month, year and weekday columns from original timestamp column
+    with metrics.stage("derive_time_columns", "transform"):
+        df = add_time_columns(df, "ts", engine=TIME_ENGINE)
 
     # extract columns to create time table
-    time_table = df.select([
+    time_table = df.selectExpr([
         "ts as start_time",
-        "datetime.hour as hour",
-        "datetime.day as day",
-        "datetime.isocalendar()[1] as week",
-        "datetime.month as month",
-        "datetime.year as year",
+        "hour",
+        "day",
+        "week",
+        "month",
+        "year",
         "weekday",
     ]).dropDuplicates()
 
     # write time table to parquet files partitioned by year and month
-    time_table.write.partitionBy("year", "month").parquet(output_data + "time.parquet", mode="overwrite")
-
-    # extract columns from joined song and log datasets to create songplays table 
-    songplays_table = songs_table.alias('s').join(
-        df.alias('e'), col('s.title') == col('e.song')
-    ).select([
-        col('e.ts').alias('start_time'),
-        col('e.userId').alias('user_id'),
-        col('e.level').alias('level'),
-        col('s.song_id').alias('song_id'),
-        col('s.artist_id').alias('artist_id'),
-        col('e.sessionId').alias('session_id'),
-        col('e.location').alias('location'),
-        col('e.userAgent').alias('user_agent'),
-        year('datetime').alias('year'),
-        month('datetime').alias('month')
-    ])
-
-    # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.partitionBy('year', 'month').parquet(output_data + "songplays_table.parquet", mode="overwrite")
+    def write_time():
+        if incremental:
+            write_partitions(time_table, output_data + "time.parquet", TABLE_LAYOUTS["time"], write_mode, replace_partitions)
+        else:
+            write_table(time_table, output_data + "time.parquet", TABLE_LAYOUTS["time"])
+
+    scheduler.submit("write_time", write_time, pool="time")
+
+    # extract columns from joined song and log datasets to create songplays table and
+    # write it to parquet files partitioned by year and month, once the song lookup is loaded
+    def write_songplays():
+        with metrics.stage("join_songplays", "transform") as stage:
+            lookup_bytes = lookup_size(spark, output_data + "song_lookup.parquet")
+            stage["broadcast"] = lookup_bytes <= BROADCAST_THRESHOLD
+            songplays_table = join_song_lookup(
+                spark, df, scheduler.result("load_song_lookup"), lookup_bytes, BROADCAST_THRESHOLD
+            ).select([
+                col('ts').alias('start_time'),
+                col('userId').alias('user_id'),
+                col('level').alias('level'),
+                col('song_id').alias('song_id'),
+                col('artist_id').alias('artist_id'),
+                col('sessionId').alias('session_id'),
+                col('location').alias('location'),
+                col('userAgent').alias('user_agent'),
+                col('year').alias('year'),
+                col('month').alias('month')
+            ])
+
+        if incremental:
+            write_partitions(songplays_table, output_data + "songplays_table.parquet", TABLE_LAYOUTS["songplays"],
+                             write_mode, replace_partitions)
+        else:
+            write_table(songplays_table, output_data + "songplays_table.parquet", TABLE_LAYOUTS["songplays"])
+
+    scheduler.submit("write_songplays", write_songplays, depends_on=["load_song_lookup"], pool="songplays")
+
+def log_file_partitions(spark, log_files, partition_columns):
+    """
+    This function returns the partitions of the time and songplays tables every log file has events in,
+    none for the files without song plays.
+    """
+    df = read_input(spark, log_files, event_log_schema)
+    df = add_time_columns(df.filter(df.page == "NextSong"), "ts", engine="native")
+    partitions = collect_file_partitions(df, partition_columns)
+    return dict((path, partitions.get(path, [])) for path in log_files)
+
+def choose_engine(engine, input_data):
+    """
+    This function resolves the auto engine: the local pyarrow engine is used for full runs over local inputs
+    up to LOCAL_ENGINE_MAX_MB, spark is used otherwise.
+    """
+    if engine != "auto":
+        return engine
+    if MODE == "full" and READ_FROM == "raw" and is_local(input_data) and input_size(input_data) <= LOCAL_ENGINE_MAX_BYTES:
+        return "local"
+    return "spark"
 
 def main():
     """
-    - Creates a spark session
+    - Assign values to input_data and output_data, from the command line or dl.cfg
+
+    - Runs the local pyarrow engine (local_etl.py) when it is chosen, without starting spark
 
-    - Assign values to input_data and output_data
+    - Creates a spark session, refusing in incremental mode the committers that can't overwrite single partitions
     
     - Calls functions process_song_data and process_log_data which reads from S3 and loads to S3
+
+    - In incremental mode, only log files missing from the manifest are processed, along with the files sharing
+      partitions with the ones that changed since they were processed, and the manifest is updated with the files
+      and their partitions after all tables are written
+
+    - Writes the run report with the metrics of every stage to REPORT_PATH (and PROMETHEUS_PATH when it is set)
     """
+    parser = argparse.ArgumentParser(description="Loads the Sparkify song and log data into the data lake")
+    parser.add_argument("--engine", choices=["spark", "local", "auto"], default=ENGINE)
+    parser.add_argument("--input-data", default=INPUT_DATA)
+    parser.add_argument("--output-data", default=OUTPUT_DATA)
+    args = parser.parse_args()
+
+    input_data = args.input_data
+    output_data = args.output_data
+
+    engine = choose_engine(args.engine, input_data)
+    if engine == "local":
+        if MODE != "full" or READ_FROM != "raw":
+            raise ValueError("The local engine only supports MODE=full and READ_FROM=raw")
+        metrics = RunMetrics(engine=engine, mode=MODE)
+        with metrics.stage("local_etl", "write"):
+            run_local(input_data, output_data, TABLE_LAYOUTS)
+        metrics.write(REPORT_PATH, PROMETHEUS_PATH)
+        return
+
+    # incremental runs merge the users buckets and changed log files by overwriting single partitions,
+    # full runs only overwrite whole tables, which every committer supports
+    if MODE == "incremental":
+        check_dynamic_overwrite(S3A_COMMITTER, S3A_CONFLICT_MODE)
+
     spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = "s3a://udacity-sparkify-project/"
-    
-    songs_table = process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data, songs_table)
+    metrics = RunMetrics(spark, engine=engine, mode=MODE, write_concurrency=WRITE_CONCURRENCY)
+    scheduler = WriteScheduler(spark, metrics, WRITE_CONCURRENCY)
+
+    if MODE == "incremental":
+        manifest = read_manifest(spark, MANIFEST_PATH)
+        input_files = list_input_files(spark, input_paths(input_data)[1])
+        new_files = find_new_files(input_files, manifest)
+        metrics.run_info["new_log_files"] = len(new_files)
+        if not new_files:
+            print("No new log files since {}".format(manifest["updated_at"]))
+            metrics.write(REPORT_PATH, PROMETHEUS_PATH)
+            return
+
+        print("Processing {} new log files".format(len(new_files)))
+        partition_columns = TABLE_LAYOUTS["songplays"]["partition_by"]
+        with metrics.stage("log_file_partitions", "read"):
+            batch_partitions = log_file_partitions(spark, new_files, partition_columns)
+        # rows of changed files were already written, their partitions are rebuilt from every file with rows on them
+        write_mode = INCREMENTAL_WRITE
+        replace_partitions = None
+        changed_files = find_changed_files(input_files, manifest)
+        if changed_files:
+            if TABLE_LAYOUTS["time"]["partition_by"] != partition_columns:
+                raise ValueError("Reprocessing changed log files needs the same partition columns on time and songplays")
+            untracked = [
+                path for path in manifest["files"]
+                if path in input_files and path not in new_files and path not in manifest.get("partitions", {})
+            ]
+            if untracked:
+                with metrics.stage("log_file_partitions_untracked", "read"):
+                    manifest.setdefault("partitions", {}).update(log_file_partitions(spark, untracked, partition_columns))
+            new_files, replace_partitions = expand_changed_files(manifest, input_files, new_files, batch_partitions)
+            print("{} log files changed since they were processed, replacing {} partitions with the rows of {} files".format(
+                len(changed_files), len(replace_partitions), len(new_files)))
+            write_mode = "replace"
+        if REUSE_SONG_LOOKUP and lookup_exists(spark, output_data + "song_lookup.parquet"):
+            scheduler.submit("load_song_lookup", lambda: persist(
+                spark.read.parquet(output_data + "song_lookup.parquet"), SONG_STORAGE_LEVEL
+            ), kind="read", pool="song_lookup")
+        else:
+            process_song_data(spark, input_data, output_data, metrics, scheduler)
+        process_log_data(spark, input_data, output_data, metrics, scheduler, log_files=new_files, write_mode=write_mode,
+                         replace_partitions=replace_partitions)
+        scheduler.wait()
+        scheduler.result("load_song_lookup").unpersist()
+        write_manifest(spark, MANIFEST_PATH, update_manifest(manifest, input_files, new_files, batch_partitions))
+    else:
+        process_song_data(spark, input_data, output_data, metrics, scheduler)
+        process_log_data(spark, input_data, output_data, metrics, scheduler)
+        scheduler.wait()
+        scheduler.result("load_song_lookup").unpersist()
 
+    report = metrics.write(REPORT_PATH, PROMETHEUS_PATH)
+    for stage in report["stages"]:
+        print("{:<22} {:>10.3f}s".format(stage["name"], stage["wall_seconds"]))
 
 if __name__ == "__main__":
     main()
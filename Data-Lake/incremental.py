@@ -0,0 +1,181 @@
+import json
+from datetime import datetime
+from functools import reduce
+from pyspark.sql.functions import col, input_file_name
+from writer import write_table
+
+
+def get_filesystem(spark, path):
+    """
+    Returns the hadoop FileSystem and Path objects for path, so s3a:// and local paths are handled alike.
+    """
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs, hadoop_path
+
+
+def list_input_files(spark, pattern):
+    """
+    Lists the files matching a glob pattern with their size and modification time.
+    """
+    fs, hadoop_path = get_filesystem(spark, pattern)
+    statuses = fs.globStatus(hadoop_path) or []
+    return {
+        status.getPath().toString(): {
+            "size": status.getLen(),
+            "modified": status.getModificationTime(),
+        }
+        for status in statuses if status.isFile()
+    }
+
+
+def read_manifest(spark, path):
+    """
+    Reads the manifest holding the already processed input files and the partitions every one of them has rows in.
+    A missing manifest means nothing was processed yet.
+    """
+    fs, hadoop_path = get_filesystem(spark, path)
+    if not fs.exists(hadoop_path):
+        return {"files": {}, "partitions": {}, "updated_at": None}
+
+    content = "\n".join(row.value for row in spark.read.text(path).collect())
+    return json.loads(content)
+
+
+def write_manifest(spark, path, manifest):
+    """
+    Overwrites the manifest on path.
+    """
+    manifest["updated_at"] = datetime.utcnow().isoformat()
+
+    fs, hadoop_path = get_filesystem(spark, path)
+    stream = fs.create(hadoop_path, True)
+    try:
+        stream.write(bytearray(json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")))
+    finally:
+        stream.close()
+
+
+def find_new_files(input_files, manifest):
+    """
+    Returns the input files that are not on the manifest or that changed since they were processed.
+    """
+    processed = manifest["files"]
+    return sorted(
+        path for path, status in input_files.items()
+        if processed.get(path) != status
+    )
+
+
+def find_changed_files(input_files, manifest):
+    """
+    Returns the input files already on the manifest that changed since they were processed. Their rows were
+    written before, so appending them again would duplicate them.
+    """
+    processed = manifest["files"]
+    return sorted(
+        path for path, status in input_files.items()
+        if path in processed and processed[path] != status
+    )
+
+
+def collect_file_partitions(df, partition_columns):
+    """
+    Returns the partitions every input file of df has rows in, as {path: [[value, ...], ...]},
+    with paths written like list_input_files writes them.
+    """
+    jvm = df.sparkSession.sparkContext._jvm
+    partitions = {}
+    for row in df.select(input_file_name().alias("path"), *partition_columns).distinct().collect():
+        path = jvm.org.apache.hadoop.fs.Path(row["path"]).toString()
+        partitions.setdefault(path, []).append([row[column] for column in partition_columns])
+    return partitions
+
+
+def expand_changed_files(manifest, input_files, new_files, batch_partitions):
+    """
+    Returns the files to process again when some of new_files changed since they were processed, and the partitions
+    to replace with their rows: the partitions of the old version of the changed files, on the manifest, and of the
+    new version of the batch, plus every processed file with rows on them, until no file adds a partition.
+    Files processed before their partitions were recorded only count with their new version.
+    """
+    recorded = manifest.get("partitions", {})
+    touched = set(tuple(partition) for path in new_files for partition in recorded.get(path, []))
+    touched.update(tuple(partition) for partitions in batch_partitions.values() for partition in partitions)
+    files = set(new_files)
+    while True:
+        added = [
+            path for path, partitions in recorded.items()
+            if path in input_files and path not in files and touched.intersection(tuple(partition) for partition in partitions)
+        ]
+        if not added:
+            return sorted(files), sorted(touched)
+        files.update(added)
+        for path in added:
+            touched.update(tuple(partition) for partition in recorded[path])
+
+
+def update_manifest(manifest, input_files, new_files, partitions=None):
+    """
+    Marks new_files as processed, with the partitions they have rows in when they are given.
+    """
+    for path in new_files:
+        manifest["files"][path] = input_files[path]
+    if partitions is not None:
+        manifest.setdefault("partitions", {}).update(partitions)
+    # manifests written by previous versions kept an event time watermark nothing reads
+    manifest.pop("watermark", None)
+    return manifest
+
+
+def write_partitions(df, path, layout, write_mode, replace_partitions=None):
+    """
+    Writes df to a parquet table with the given layout touching only the partitions present on df.
+
+    - append: adds the new files to the partitions, previous files are kept as they are
+
+    - dynamic: merges the rows already stored on the affected partitions with df, removes duplicates
+      and replaces only those partitions
+
+    - replace: df holds every row of replace_partitions, which replace the stored ones. Partitions of
+      replace_partitions without rows on df are removed
+    """
+    partition_columns = layout["partition_by"]
+    writer_mode = "append"
+
+    if write_mode == "dynamic":
+        if not partition_columns:
+            raise ValueError("Dynamic incremental writes need a partitioned table layout")
+        spark = df.sparkSession
+        fs, hadoop_path = get_filesystem(spark, path)
+        if fs.exists(hadoop_path):
+            touched = df.select(*partition_columns).distinct().collect()
+            if not touched:
+                return
+            existing = spark.read.parquet(path).where(reduce(lambda a, b: a | b, [
+                reduce(lambda a, b: a & b, [col(c) == row[c] for c in partition_columns])
+                for row in touched
+            ]))
+            # checkpointing cuts the lineage to path, which is about to be overwritten
+            df = existing.unionByName(df).dropDuplicates().localCheckpoint()
+        writer_mode = "overwrite"
+    elif write_mode == "replace":
+        if not partition_columns:
+            raise ValueError("Replacing partitions needs a partitioned table layout")
+        spark = df.sparkSession
+        fs, hadoop_path = get_filesystem(spark, path)
+        written = set(tuple(row) for row in df.select(*partition_columns).distinct().collect())
+        for partition in replace_partitions or []:
+            if tuple(partition) in written:
+                continue
+            _, folder = get_filesystem(spark, path + "/" + "/".join(
+                "{}={}".format(column, value) for column, value in zip(partition_columns, partition)
+            ))
+            if fs.exists(folder):
+                fs.delete(folder, True)
+        writer_mode = "overwrite"
+    elif write_mode != "append":
+        raise ValueError("Unknown incremental write mode {}. Use append, dynamic or replace".format(write_mode))
+
+    write_table(df, path, layout, mode=writer_mode, dynamic=True)
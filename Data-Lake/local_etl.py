@@ -0,0 +1,257 @@
+import glob
+import json
+import os
+import zipfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs as pafs
+from pyspark.sql.types import IntegerType, StringType, DoubleType, LongType
+from schemas import song_log_schema, event_log_schema
+
+
+ARROW_TYPES = {
+    IntegerType(): pa.int32(),
+    LongType(): pa.int64(),
+    DoubleType(): pa.float64(),
+    StringType(): pa.string(),
+}
+
+# zip archives shipped on data/ and the dataset stored in each one
+ARCHIVES = {
+    "song_data": "song-data.zip",
+    "log_data": "log-data.zip",
+}
+
+
+def arrow_schema(spark_schema):
+    """
+    This function converts one of the spark schemas on schemas.py to the equivalent pyarrow schema.
+    """
+    return pa.schema([(field.name, ARROW_TYPES[field.dataType]) for field in spark_schema.fields])
+
+
+def is_local(path):
+    """
+    This function checks whether path is on the local filesystem.
+    """
+    return "://" not in path or path.startswith("file://")
+
+
+def iter_json_sources(input_data, dataset):
+    """
+    This function yields (name, raw bytes) for every json file of a dataset under input_data,
+    read from the dataset folder when it exists or straight from its zip archive otherwise.
+    """
+    input_data = input_data.replace("file://", "")
+    folder = os.path.join(input_data, dataset)
+    if os.path.isdir(folder):
+        for path in sorted(glob.glob(os.path.join(folder, "**", "*.json"), recursive=True)):
+            with open(path, "rb") as f:
+                yield path, f.read()
+        return
+
+    with zipfile.ZipFile(os.path.join(input_data, ARCHIVES[dataset])) as archive:
+        for name in sorted(archive.namelist()):
+            if name.endswith(".json") and not name.startswith("__MACOSX"):
+                yield name, archive.read(name)
+
+
+def input_size(input_data):
+    """
+    This function returns the total size in bytes of the song and log json files, or zip archives, under input_data.
+    """
+    input_data = input_data.replace("file://", "")
+    size = 0
+    for dataset, archive in ARCHIVES.items():
+        folder = os.path.join(input_data, dataset)
+        if os.path.isdir(folder):
+            size += sum(os.path.getsize(path) for path in glob.glob(os.path.join(folder, "**", "*.json"), recursive=True))
+        elif os.path.exists(os.path.join(input_data, archive)):
+            size += os.path.getsize(os.path.join(input_data, archive))
+    return size
+
+
+def convert(value, arrow_type):
+    """
+    This function converts a json value to a field type, returning None when it can't be converted,
+    the same way DROPMALFORMED leaves malformed fields out.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        if pa.types.is_integer(arrow_type):
+            return int(value)
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_json(input_data, dataset, spark_schema):
+    """
+    This function reads every json record of a dataset into a pyarrow Table with the given schema.
+    Files hold one json object per line, malformed lines are skipped.
+    """
+    schema = arrow_schema(spark_schema)
+    rows = []
+    for _, content in iter_json_sources(input_data, dataset):
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            rows.append({field.name: convert(record.get(field.name), field.type) for field in schema})
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+def distinct(table, keys=None):
+    """
+    This function removes duplicated rows, or rows with duplicated keys keeping the first one, like dropDuplicates.
+    """
+    keys = keys or table.column_names
+    others = [name for name in table.column_names if name not in keys]
+    grouped = table.group_by(keys, use_threads=False).aggregate([(name, "first") for name in others])
+    names = [
+        name[:-len("_first")] if name.endswith("_first") and name[:-len("_first")] in others else name
+        for name in grouped.column_names
+    ]
+    return grouped.rename_columns(names).select(table.column_names)
+
+
+def write_table(table, path, layout):
+    """
+    This function overwrites path with table following the same layout as writer.write_table:
+    hive style partition folders, at most max_records_per_file rows per file and rows sorted by the sort columns.
+    """
+    filesystem, base_dir = pafs.FileSystem.from_uri(path.replace("s3a://", "s3://")) if not is_local(path) \
+        else (pafs.LocalFileSystem(), os.path.abspath(path.replace("file://", "")))
+    filesystem.create_dir(base_dir, recursive=True)
+    filesystem.delete_dir_contents(base_dir, missing_dir_ok=True)
+
+    sort_by = layout["partition_by"] + layout["sort_by"]
+    if sort_by:
+        table = table.sort_by([(column, "ascending") for column in sort_by])
+
+    max_rows = layout["max_records_per_file"]
+    ds.write_dataset(
+        table,
+        base_dir,
+        filesystem=filesystem,
+        format="parquet",
+        partitioning=layout["partition_by"] or None,
+        partitioning_flavor="hive" if layout["partition_by"] else None,
+        basename_template="part-{i}.snappy.parquet",
+        max_rows_per_file=max_rows,
+        max_rows_per_group=min(max_rows, 1024 * 1024),
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def song_keys(title, artist_name, duration):
+    """
+    This function returns the normalized lookup keys, the same as song_lookup.song_keys. Durations are rounded
+    half up like Spark's round, instead of the half to even default of arrow.
+    """
+    return [
+        pc.utf8_lower(pc.utf8_trim_whitespace(title)),
+        pc.utf8_lower(pc.utf8_trim_whitespace(artist_name)),
+        pc.cast(pc.round(pc.multiply(duration, 100), round_mode="half_up"), pa.int32()),
+    ]
+
+
+def process_song_data(input_data, output_data, layouts):
+    """
+    - Reads song_data from a local folder or from song-data.zip
+
+    - Writes songs, artists and song lookup tables the same way etl.process_song_data does
+
+    - Returns the song lookup
+    """
+    song_data = distinct(read_json(input_data, "song_data", song_log_schema))
+
+    songs_table = song_data.select(["song_id", "title", "artist_id", "year", "duration"])
+    songs_table = distinct(songs_table.filter(pc.is_valid(songs_table["song_id"])))
+    write_table(songs_table, output_data + "songs.parquet", layouts["songs"])
+
+    artists_table = song_data.select([
+        "artist_id", "artist_name", "artist_location", "artist_latitude", "artist_longitude"
+    ]).rename_columns(["artist_id", "name", "location", "latitude", "longitude"])
+    artists_table = distinct(artists_table.filter(pc.is_valid(artists_table["artist_id"])))
+    write_table(artists_table, output_data + "artists.parquet", layouts["artists"])
+
+    song_lookup = pa.table(
+        song_keys(song_data["title"], song_data["artist_name"], song_data["duration"])
+        + [song_data["song_id"], song_data["artist_id"]],
+        names=["title_key", "artist_key", "duration_key", "song_id", "artist_id"],
+    )
+    song_lookup = distinct(
+        song_lookup.filter(pc.is_valid(song_lookup["song_id"])), ["title_key", "artist_key", "duration_key"]
+    )
+    write_table(song_lookup, output_data + "song_lookup.parquet", layouts["song_lookup"])
+
+    return song_lookup
+
+
+def process_log_data(input_data, output_data, song_lookup, layouts):
+    """
+    - Reads log_data from a local folder or from log-data.zip and keeps NextSong events
+
+    - Writes users, time and songplays tables the same way etl.process_log_data does
+    """
+    df = read_json(input_data, "log_data", event_log_schema)
+    df = df.filter(pc.equal(df["page"], "NextSong"))
+
+    # latest state of every user, the same as users_dimension.latest_users
+    users_table = df.select(["userId", "firstName", "lastName", "gender", "level", "ts"])
+    users_table = users_table.filter(pc.is_valid(users_table["userId"])).sort_by([("ts", "descending")])
+    users_table = distinct(users_table, ["userId"])
+    buckets = layouts["users"]["buckets"]
+    user_ids = users_table["userId"]
+    users_table = users_table.append_column(
+        "user_bucket", pc.subtract(user_ids, pc.multiply(pc.divide(user_ids, buckets), buckets))
+    )
+    write_table(users_table, output_data + "users.parquet", layouts["users"])
+
+    # timestamps are read as UTC, which matches spark.sql.session.timeZone on create_spark_session
+    dt = pc.cast(df["ts"], pa.timestamp("ms"))
+    time_columns = {
+        "hour": pc.hour(dt),
+        "day": pc.day(dt),
+        "week": pc.iso_week(dt),
+        "month": pc.month(dt),
+        "year": pc.year(dt),
+        "weekday": pc.day_of_week(dt),
+    }
+    for name, values in time_columns.items():
+        df = df.append_column(name, pc.cast(values, pa.int32()))
+
+    time_table = distinct(
+        df.select(["ts", "hour", "day", "week", "month", "year", "weekday"]).rename_columns(
+            ["start_time", "hour", "day", "week", "month", "year", "weekday"]
+        )
+    )
+    write_table(time_table, output_data + "time.parquet", layouts["time"])
+
+    keys = song_keys(df["song"], df["artist"], df["length"])
+    for name, values in zip(["title_key", "artist_key", "duration_key"], keys):
+        df = df.append_column(name, values)
+    joined = df.join(song_lookup, ["title_key", "artist_key", "duration_key"], join_type="inner", use_threads=False)
+
+    songplays_table = joined.select([
+        "ts", "userId", "level", "song_id", "artist_id", "sessionId", "location", "userAgent", "year", "month"
+    ]).rename_columns([
+        "start_time", "user_id", "level", "song_id", "artist_id", "session_id", "location", "user_agent", "year", "month"
+    ])
+    write_table(songplays_table, output_data + "songplays_table.parquet", layouts["songplays"])
+
+
+def run(input_data, output_data, layouts):
+    """
+    This function runs the song and log stages in process without starting spark.
+    """
+    song_lookup = process_song_data(input_data, output_data, layouts)
+    process_log_data(input_data, output_data, song_lookup, layouts)
@@ -0,0 +1,138 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.request import urlopen
+
+
+# spark stage metrics from the monitoring REST API summed for every job of a named stage
+STAGE_METRICS = {
+    "inputRecords": "input_rows",
+    "inputBytes": "input_bytes",
+    "outputRecords": "output_rows",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_spill_bytes",
+    "diskBytesSpilled": "disk_spill_bytes",
+}
+
+
+class RunMetrics:
+    """
+    Records named stages of a Data-Lake run and builds the run report.
+
+    Every stage runs its spark jobs under its own job group, so after the run the jobs of a stage are found
+    with the status tracker and their task metrics are read from the spark monitoring REST API.
+    When spark is None (local engine) only wall times are recorded.
+    """
+
+    def __init__(self, spark=None, **run_info):
+        self.spark = spark
+        self.run_info = run_info
+        self.started_at = datetime.utcnow()
+        self.start = time.time()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, kind):
+        """
+        Times the block as a stage of the given kind (read, transform or write) and tags its spark jobs.
+        """
+        record = {"name": name, "kind": kind}
+        if self.spark is not None:
+            sc = self.spark.sparkContext
+            previous_group = sc.getLocalProperty("spark.jobGroup.id")
+            sc.setJobGroup(name, "{} {}".format(kind, name))
+        start = time.time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = round(time.time() - start, 3)
+            if self.spark is not None:
+                record["job_ids"] = list(sc.statusTracker().getJobIdsForGroup(name))
+                # nested stages hand the job group back to the enclosing stage
+                sc.setLocalProperty("spark.jobGroup.id", previous_group)
+            self.stages.append(record)
+
+    def stage_metrics(self, job_ids):
+        """
+        Returns the summed REST API metrics of every spark stage run by the given jobs.
+        """
+        sc = self.spark.sparkContext
+        tracker = sc.statusTracker()
+        totals = dict.fromkeys(STAGE_METRICS.values(), 0)
+        if not sc.uiWebUrl:
+            return totals
+
+        stage_ids = set()
+        for job_id in job_ids:
+            job = tracker.getJobInfo(job_id)
+            if job is not None:
+                stage_ids.update(job.stageIds)
+
+        for stage_id in stage_ids:
+            url = "{}/api/v1/applications/{}/stages/{}".format(sc.uiWebUrl, sc.applicationId, stage_id)
+            try:
+                attempts = json.load(urlopen(url, timeout=10))
+            except (IOError, ValueError):
+                continue
+            for attempt in attempts:
+                for metric, name in STAGE_METRICS.items():
+                    totals[name] += attempt.get(metric, 0)
+        return totals
+
+    def report(self):
+        """
+        Returns the run report with the metrics of every stage.
+        """
+        for record in self.stages:
+            if "job_ids" in record:
+                record.update(self.stage_metrics(record["job_ids"]))
+
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(time.time() - self.start, 3),
+            "stages": self.stages,
+        }
+        report.update(self.run_info)
+        if self.spark is not None:
+            report["application_id"] = self.spark.sparkContext.applicationId
+        return report
+
+    def write(self, report_path, prometheus_path=None):
+        """
+        Writes the json run report and, when prometheus_path is set, a text file for the prometheus node exporter
+        textfile collector.
+        """
+        report = self.report()
+        for path in filter(None, [report_path, prometheus_path]):
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        if prometheus_path:
+            with open(prometheus_path, "w") as f:
+                f.write(prometheus_text(report))
+        return report
+
+
+def prometheus_text(report):
+    """
+    Formats the numeric stage metrics of a run report in the prometheus text exposition format.
+    """
+    lines = [
+        "# TYPE sparkify_lake_run_seconds gauge",
+        "sparkify_lake_run_seconds {}".format(report["wall_seconds"]),
+    ]
+    metrics = ["wall_seconds"] + list(STAGE_METRICS.values())
+    for metric in metrics:
+        lines.append("# TYPE sparkify_lake_stage_{} gauge".format(metric))
+        for record in report["stages"]:
+            if metric in record:
+                lines.append('sparkify_lake_stage_{}{{stage="{}",kind="{}"}} {}'.format(
+                    metric, record["name"], record["kind"], record[metric]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class WriteScheduler:
+    """
+    Runs the independent actions of a Data-Lake run (mostly table writes) from a bounded thread pool.
+
+    Each action is submitted with the names of the actions it depends on and only starts once they finished,
+    so waiting actions never hold a thread. Spark jobs of an action run on their own FAIR scheduler pool,
+    named after the action, and every action is recorded as a stage of metrics.
+    With max_concurrency 1 actions run one after another in submission order.
+    """
+
+    def __init__(self, spark, metrics, max_concurrency=1):
+        self.spark = spark
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="lake-write")
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, name, action, depends_on=(), kind="write", pool=None):
+        """
+        Schedules action to run after the actions named on depends_on, returning a future with its result.
+        If a dependency fails the action is not run and its future fails as well.
+        """
+        future = Future()
+        dependencies = [self.futures[dependency] for dependency in depends_on]
+        self.futures[name] = future
+        submitted_at = time.time()
+        remaining = [len(dependencies)]
+
+        def start():
+            failed = [dependency for dependency in dependencies if dependency.exception() is not None]
+            if failed:
+                future.set_exception(RuntimeError("{} skipped because a dependency failed".format(name)))
+                return
+            inner = self.executor.submit(self.run, name, action, kind, pool or name, submitted_at)
+            inner.add_done_callback(lambda done: copy_result(done, future))
+
+        def dependency_done(_):
+            with self.lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        if not dependencies:
+            start()
+        for dependency in dependencies:
+            dependency.add_done_callback(dependency_done)
+        return future
+
+    def run(self, name, action, kind, pool, submitted_at):
+        """
+        Runs action on the calling worker thread inside its FAIR pool and metrics stage.
+        """
+        sc = self.spark.sparkContext
+        sc.setLocalProperty("spark.scheduler.pool", pool)
+        try:
+            with self.metrics.stage(name, kind) as stage:
+                stage["pool"] = pool
+                stage["queued_seconds"] = round(time.time() - submitted_at, 3)
+                return action()
+        finally:
+            sc.setLocalProperty("spark.scheduler.pool", None)
+
+    def result(self, name):
+        """
+        Waits for an action and returns its result.
+        """
+        return self.futures[name].result()
+
+    def wait(self):
+        """
+        Waits for every submitted action and shuts the pool down, raising the first failure.
+        """
+        errors = []
+        for future in list(self.futures.values()):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        self.executor.shutdown()
+        if errors:
+            raise errors[0]
+
+
+def copy_result(source, target):
+    """
+    Copies the result or exception of a finished future to another future.
+    """
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,38 @@
+from pyspark.sql.types import StructType, StructField, IntegerType, StringType, DoubleType, LongType
+
+
+# song schema
+song_log_schema = StructType([
+    StructField("num_songs",IntegerType()),
+    StructField("artist_id",StringType()),
+    StructField("artist_latitude",DoubleType()),
+    StructField("artist_longitude",DoubleType()),
+    StructField("artist_location",StringType()),
+    StructField("artist_name",StringType()),
+    StructField("song_id",StringType()),
+    StructField("title",StringType()),
+    StructField("duration",DoubleType()),
+    StructField("year",IntegerType()),
+])
+
+# event schema
+event_log_schema = StructType([
+    StructField("artist",StringType()),
+    StructField("auth",StringType()),
+    StructField("firstName",StringType()),
+    StructField("gender",StringType()),
+    StructField("itemInSession",IntegerType()),
+    StructField("lastName",StringType()),
+    StructField("length",DoubleType()),
+    StructField("level",StringType()),
+    StructField("location",StringType()),
+    StructField("method",StringType()),
+    StructField("page",StringType()),
+    StructField("registration",DoubleType()),
+    StructField("sessionId",IntegerType()),
+    StructField("song",StringType()),
+    StructField("status",IntegerType()),
+    StructField("ts",LongType()),
+    StructField("userAgent",StringType()),
+    StructField("userId",IntegerType()),
+])
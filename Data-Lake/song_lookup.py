@@ -0,0 +1,67 @@
+from pyspark.sql.functions import broadcast, col, lower, round as round_, trim
+from incremental import get_filesystem
+
+
+LOOKUP_KEYS = ["title_key", "artist_key", "duration_key"]
+
+
+def song_keys(title, artist_name, duration):
+    """
+    Returns the normalized lookup key columns: trimmed lower case title and artist name and
+    the duration in hundredths of a second, the same fields SqlQueries.songplay_table_insert matches on.
+    """
+    return [
+        lower(trim(title)).alias("title_key"),
+        lower(trim(artist_name)).alias("artist_key"),
+        round_(duration * 100).cast("int").alias("duration_key"),
+    ]
+
+
+def build_song_lookup(song_data):
+    """
+    Builds the compact song lookup with one row per (title, artist name, duration) key
+    and only the ids songplays needs.
+    """
+    return song_data.select(
+        song_keys(col("title"), col("artist_name"), col("duration")) + [col("song_id"), col("artist_id")]
+    ).where(
+        col("song_id").isNotNull()
+    ).dropDuplicates(LOOKUP_KEYS)
+
+
+def lookup_exists(spark, path):
+    """
+    Checks whether a song lookup was already persisted on path by a previous run.
+    """
+    fs, hadoop_path = get_filesystem(spark, path)
+    return fs.exists(hadoop_path)
+
+
+def lookup_size(spark, path):
+    """
+    Returns the size in bytes of the persisted song lookup.
+    """
+    fs, hadoop_path = get_filesystem(spark, path)
+    return fs.getContentSummary(hadoop_path).getLength()
+
+
+def join_song_lookup(spark, events, song_lookup, lookup_bytes, broadcast_threshold):
+    """
+    Joins events to the song lookup on the normalized keys.
+
+    - When the persisted lookup is smaller than broadcast_threshold bytes it is broadcast to the executors,
+      so events are never shuffled
+
+    - Otherwise it falls back to a sort merge join with adaptive skew join handling, which splits
+      the partitions of frequently played songs instead of sending them all to a single task
+    """
+    events = events.select(
+        ["*"] + song_keys(col("song"), col("artist"), col("length"))
+    )
+
+    if lookup_bytes <= broadcast_threshold:
+        return events.join(broadcast(song_lookup), LOOKUP_KEYS)
+
+    spark.conf.set("spark.sql.adaptive.enabled", "true")
+    spark.conf.set("spark.sql.adaptive.skewJoin.enabled", "true")
+    return events.join(song_lookup.hint("merge"), LOOKUP_KEYS)
@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+from pyspark.sql.functions import udf, pandas_udf, col
+from pyspark.sql.functions import year, month, dayofmonth, dayofweek, hour, weekofyear
+from pyspark.sql.types import StructType, StructField, IntegerType, TimestampType
+
+
+TIME_COLUMNS = ["hour", "day", "week", "month", "year", "weekday"]
+
+time_parts_schema = StructType([
+    StructField("datetime", TimestampType()),
+    StructField("hour", IntegerType()),
+    StructField("day", IntegerType()),
+    StructField("week", IntegerType()),
+    StructField("month", IntegerType()),
+    StructField("year", IntegerType()),
+    StructField("weekday", IntegerType()),
+])
+
+
+def add_time_columns_native(df, ts_column="ts"):
+    """
+    Derives datetime, hour, day, week, month, year and weekday from an epoch
+    milliseconds column using built-in Spark functions only, so rows never leave the JVM.
+
+    - week is the ISO week number (same as datetime.isocalendar()[1])
+
+    - weekday follows python's datetime.weekday(): Monday is 0 and Sunday is 6
+    """
+    df = df.withColumn("datetime", (col(ts_column) / 1000).cast(TimestampType()))
+    return df \
+        .withColumn("hour", hour("datetime")) \
+        .withColumn("day", dayofmonth("datetime")) \
+        .withColumn("week", weekofyear("datetime")) \
+        .withColumn("month", month("datetime")) \
+        .withColumn("year", year("datetime")) \
+        .withColumn("weekday", (dayofweek("datetime") + 5) % 7)
+
+
+def add_time_columns_arrow(df, ts_column="ts"):
+    """
+    Derives the same columns as add_time_columns_native with a single Arrow-backed pandas UDF.
+    It is the fallback for spark versions or derivations that built-in functions can't express,
+    and it still moves whole column batches instead of pickling one row at a time.
+    """
+    import pandas as pd
+
+    @pandas_udf(time_parts_schema)
+    def time_parts(ts):
+        dt = pd.to_datetime(ts, unit="ms")
+        return pd.DataFrame({
+            "datetime": dt,
+            "hour": dt.dt.hour,
+            "day": dt.dt.day,
+            "week": dt.dt.isocalendar().week.astype("int32"),
+            "month": dt.dt.month,
+            "year": dt.dt.year,
+            "weekday": dt.dt.weekday,
+        })
+
+    df = df.withColumn("time_parts", time_parts(col(ts_column)))
+    for column in ["datetime"] + TIME_COLUMNS:
+        df = df.withColumn(column, col("time_parts." + column))
+    return df.drop("time_parts")
+
+
+def add_time_columns_udf(df, ts_column="ts"):
+    """
+    Row-at-a-time python UDF derivation kept only as the baseline for bench_time_columns.py.
+    Timestamps are read as UTC like the other derivations, whatever the timezone of the executors.
+    """
+    get_datetime = udf(lambda x: datetime.fromtimestamp(x / 1000, tz=timezone.utc), TimestampType())
+    df = df.withColumn("datetime", get_datetime(col(ts_column)))
+
+    get_parts = udf(lambda x: (
+        x, x.hour, x.day, x.isocalendar()[1], x.month, x.year, x.weekday()
+    ), time_parts_schema)
+    df = df.withColumn("time_parts", get_parts(col("datetime")))
+    for column in TIME_COLUMNS:
+        df = df.withColumn(column, col("time_parts." + column))
+    return df.drop("time_parts")
+
+
+TIME_ENGINES = {
+    "native": add_time_columns_native,
+    "arrow": add_time_columns_arrow,
+    "udf": add_time_columns_udf,
+}
+
+
+def add_time_columns(df, ts_column="ts", engine="native"):
+    """
+    Adds the time dimension columns to df with the chosen engine (native, arrow or udf).
+    """
+    if engine not in TIME_ENGINES:
+        raise ValueError("Unknown time engine {}. Use one of {}".format(engine, ", ".join(TIME_ENGINES)))
+    return TIME_ENGINES[engine](df, ts_column)
@@ -0,0 +1,85 @@
+DEFAULT_MAX_RECORDS_PER_FILE = 1000000
+
+# partition columns, sort columns and number of files of unpartitioned tables for every table written by etl.py
+TABLE_LAYOUTS = {
+    "songs": {"partition_by": ["year"], "sort_by": ["artist_id", "song_id"], "files": 1},
+    "artists": {"partition_by": [], "sort_by": ["artist_id"], "files": 1},
+    "users": {"partition_by": ["user_bucket"], "sort_by": ["userId"], "files": 1, "buckets": 64},
+    "time": {"partition_by": ["year", "month"], "sort_by": ["start_time"], "files": 1},
+    "songplays": {"partition_by": ["year", "month"], "sort_by": ["start_time", "user_id"], "files": 1},
+    "song_lookup": {"partition_by": [], "sort_by": ["title_key", "artist_key"], "files": 1},
+}
+
+
+def split_columns(value):
+    """
+    Splits a comma separated list of columns from dl.cfg, an empty value means no columns.
+    """
+    return [column.strip() for column in value.split(",") if column.strip()]
+
+
+def load_layouts(config):
+    """
+    Returns TABLE_LAYOUTS overridden by the LAYOUT section of dl.cfg, where keys are prefixed by the table name:
+    SONGS_PARTITION_BY, SONGS_SORT_BY, SONGS_FILES and SONGS_MAX_RECORDS_PER_FILE, plus USERS_BUCKETS
+    for the number of user_bucket partitions of the users table.
+    MAX_RECORDS_PER_FILE applies to the tables without their own value.
+    """
+    max_records = config.getint("LAYOUT", "MAX_RECORDS_PER_FILE", fallback=DEFAULT_MAX_RECORDS_PER_FILE)
+    # the partitioned S3A committer in replace mode replaces the partitions it writes by itself
+    committer_replaces_partitions = config.get("S3A", "COMMITTER", fallback="file") == "partitioned" \
+        and config.get("S3A", "CONFLICT_MODE", fallback="fail") == "replace"
+
+    layouts = {}
+    for table, defaults in TABLE_LAYOUTS.items():
+        prefix = table.upper() + "_"
+        layouts[table] = {
+            "partition_by": split_columns(config.get("LAYOUT", prefix + "PARTITION_BY", fallback=",".join(defaults["partition_by"]))),
+            "sort_by": split_columns(config.get("LAYOUT", prefix + "SORT_BY", fallback=",".join(defaults["sort_by"]))),
+            "files": config.getint("LAYOUT", prefix + "FILES", fallback=defaults["files"]),
+            "max_records_per_file": config.getint("LAYOUT", prefix + "MAX_RECORDS_PER_FILE", fallback=max_records),
+            "committer_replaces_partitions": committer_replaces_partitions,
+        }
+        if "buckets" in defaults:
+            layouts[table]["buckets"] = config.getint("LAYOUT", prefix + "BUCKETS", fallback=defaults["buckets"])
+    return layouts
+
+
+def write_table(df, path, layout, mode="overwrite", dynamic=False):
+    """
+    Writes df to a parquet table following its layout.
+
+    - Partitioned tables are repartitioned by their partition columns, so each partition is written by one task
+      and split into files of at most max_records_per_file records instead of one small file per shuffle partition
+
+    - Unpartitioned tables are range partitioned into the configured number of files
+
+    - Rows are sorted within files by the sort columns, so parquet min/max statistics let readers skip row groups
+
+    - dynamic overwrites only the partitions present on df, through spark's dynamic partition overwrite or,
+      when the partitioned S3A committer runs in replace mode, by appending and letting the committer
+      replace the partitions on job commit
+    """
+    partition_by = layout["partition_by"]
+    sort_by = layout["sort_by"]
+
+    if dynamic and mode == "overwrite" and partition_by and layout.get("committer_replaces_partitions"):
+        mode = "append"
+        dynamic = False
+
+    if partition_by:
+        df = df.repartition(*partition_by)
+    elif sort_by:
+        df = df.repartitionByRange(layout["files"], *sort_by)
+    else:
+        df = df.repartition(layout["files"])
+
+    if sort_by:
+        df = df.sortWithinPartitions(*(partition_by + sort_by))
+
+    writer = df.write.option("maxRecordsPerFile", layout["max_records_per_file"])
+    if dynamic:
+        writer = writer.option("partitionOverwriteMode", "dynamic")
+    if partition_by:
+        writer = writer.partitionBy(*partition_by)
+    writer.parquet(path, mode=mode)
@@ -0,0 +1,126 @@
+import argparse
+import os
+import sys
+
+
+AIRFLOW = os.path.dirname(os.path.abspath(__file__))
+DATA_WAREHOUSE = os.path.join(os.path.dirname(os.path.dirname(AIRFLOW)), "Data-Warehouse")
+
+# column name, type and constraints of every table, the distribution, sort keys and encodings come from physical_design.cfg
+TABLE_COLUMNS = {
+    "artists": [
+        ("artistid", "varchar(256)", "NOT NULL"),
+        ("name", "varchar(256)", ""),
+        ("location", "varchar(256)", ""),
+        ("lattitude", "numeric(18,0)", ""),
+        ("longitude", "numeric(18,0)", ""),
+    ],
+    "songplays": [
+        ("playid", "varchar(32)", "NOT NULL PRIMARY KEY"),
+        ("start_time", "timestamp", "NOT NULL"),
+        ("userid", "int4", "NOT NULL"),
+        ("level", "varchar(256)", ""),
+        ("songid", "varchar(256)", ""),
+        ("artistid", "varchar(256)", ""),
+        ("sessionid", "int4", ""),
+        ("location", "varchar(256)", ""),
+        ("user_agent", "varchar(256)", ""),
+    ],
+    "songs": [
+        ("songid", "varchar(256)", "NOT NULL PRIMARY KEY"),
+        ("title", "varchar(256)", ""),
+        ("artistid", "varchar(256)", ""),
+        ("year", "int4", ""),
+        ("duration", "numeric(18,0)", ""),
+    ],
+    "staging_events": [
+        ("artist", "varchar(256)", ""),
+        ("auth", "varchar(256)", ""),
+        ("firstname", "varchar(256)", ""),
+        ("gender", "varchar(256)", ""),
+        ("iteminsession", "int4", ""),
+        ("lastname", "varchar(256)", ""),
+        ("length", "numeric(18,0)", ""),
+        ("level", "varchar(256)", ""),
+        ("location", "varchar(256)", ""),
+        ("method", "varchar(256)", ""),
+        ("page", "varchar(256)", ""),
+        ("registration", "numeric(18,0)", ""),
+        ("sessionid", "int4", ""),
+        ("song", "varchar(256)", ""),
+        ("status", "int4", ""),
+        ("ts", "int8", ""),
+        ("useragent", "varchar(256)", ""),
+        ("userid", "int4", ""),
+    ],
+    "staging_songs": [
+        ("num_songs", "int4", ""),
+        ("artist_id", "varchar(256)", ""),
+        ("artist_name", "varchar(256)", ""),
+        ("artist_latitude", "numeric(18,0)", ""),
+        ("artist_longitude", "numeric(18,0)", ""),
+        ("artist_location", "varchar(256)", ""),
+        ("song_id", "varchar(256)", ""),
+        ("title", "varchar(256)", ""),
+        ("duration", "numeric(18,0)", ""),
+        ("year", "int4", ""),
+    ],
+    "users": [
+        ("userid", "int4", "NOT NULL PRIMARY KEY"),
+        ("first_name", "varchar(256)", ""),
+        ("last_name", "varchar(256)", ""),
+        ("gender", "varchar(256)", ""),
+        ("level", "varchar(256)", ""),
+    ],
+    "hourly_plays": [
+        ("hour_start", "timestamp", "NOT NULL"),
+        ("level", "varchar(256)", ""),
+        ("location", "varchar(256)", ""),
+        ("plays", "int8", "NOT NULL"),
+    ],
+    "daily_song_plays": [
+        ("day_start", "timestamp", "NOT NULL"),
+        ("songid", "varchar(256)", ""),
+        ("artistid", "varchar(256)", ""),
+        ("plays", "int8", "NOT NULL"),
+    ],
+    "staging_loads": [
+        ("table_name", "varchar(256)", "NOT NULL"),
+        ("s3_key", "varchar(1024)", "NOT NULL"),
+        ("etag", "varchar(256)", "NOT NULL"),
+        ("loaded_at", "timestamp", "NOT NULL"),
+    ],
+}
+
+
+def main():
+    """
+    - Reads the physical design spec of the Airflow tables, physical_design.cfg by default
+
+    - Builds the CREATE TABLE of every table of TABLE_COLUMNS with the DDL generator of Data-Warehouse/physical_design.py
+
+    - Writes them to create_tables.sql, or prints them with --dry-run
+    """
+    parser = argparse.ArgumentParser(description="Generates create_tables.sql from the physical design spec of the Airflow tables")
+    parser.add_argument("--spec", default=os.path.join(AIRFLOW, "physical_design.cfg"))
+    parser.add_argument("--output", default=os.path.join(AIRFLOW, "create_tables.sql"))
+    parser.add_argument("--dry-run", action="store_true", help="only print the DDL")
+    args = parser.parse_args()
+
+    sys.path.insert(0, DATA_WAREHOUSE)
+    from physical_design import load_design, create_table_sql
+
+    design = load_design(args.spec)
+    ddl = "-- generated by create_tables.py from physical_design.cfg, edit the spec and run it again instead of this file\n\n" + \
+        "".join(create_table_sql(table, columns, design) + ";\n\n" for table, columns in TABLE_COLUMNS.items())
+
+    if args.dry_run:
+        print(ddl)
+        return
+    with open(args.output, "w") as f:
+        f.write(ddl.rstrip("\n") + "\n")
+    print("DDL of {} tables written to {}".format(len(TABLE_COLUMNS), args.output))
+
+
+if __name__ == "__main__":
+    main()
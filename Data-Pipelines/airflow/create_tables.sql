@@ -1,90 +1,109 @@
-CREATE TABLE public.artists (
-	artistid varchar(256) NOT NULL,
-	name varchar(256),
-	location varchar(256),
-	lattitude numeric(18,0),
-	longitude numeric(18,0)
-);
+-- generated by create_tables.py from physical_design.cfg, edit the spec and run it again instead of this file
 
-CREATE TABLE public.songplays (
-	playid varchar(32) NOT NULL,
-	start_time timestamp NOT NULL,
-	userid int4 NOT NULL,
-	"level" varchar(256),
-	songid varchar(256),
-	artistid varchar(256),
-	sessionid int4,
-	location varchar(256),
-	user_agent varchar(256),
-	CONSTRAINT songplays_pkey PRIMARY KEY (playid)
-);
+CREATE TABLE IF NOT EXISTS artists (
+        artistid varchar(256) ENCODE RAW NOT NULL,
+        name varchar(256) ENCODE ZSTD,
+        location varchar(256) ENCODE ZSTD,
+        lattitude numeric(18,0) ENCODE AZ64,
+        longitude numeric(18,0) ENCODE AZ64
+    )
+    DISTSTYLE ALL
+    COMPOUND SORTKEY (artistid);
 
-CREATE TABLE public.songs (
-	songid varchar(256) NOT NULL,
-	title varchar(256),
-	artistid varchar(256),
-	"year" int4,
-	duration numeric(18,0),
-	CONSTRAINT songs_pkey PRIMARY KEY (songid)
-);
+CREATE TABLE IF NOT EXISTS songplays (
+        playid varchar(32) ENCODE ZSTD NOT NULL PRIMARY KEY,
+        start_time timestamp ENCODE RAW NOT NULL,
+        userid int4 ENCODE AZ64 NOT NULL,
+        level varchar(256) ENCODE ZSTD,
+        songid varchar(256) ENCODE ZSTD,
+        artistid varchar(256) ENCODE ZSTD,
+        sessionid int4 ENCODE AZ64,
+        location varchar(256) ENCODE ZSTD,
+        user_agent varchar(256) ENCODE ZSTD
+    )
+    DISTSTYLE EVEN
+    COMPOUND SORTKEY (start_time);
 
-CREATE TABLE public.staging_events (
-	artist varchar(256),
-	auth varchar(256),
-	firstname varchar(256),
-	gender varchar(256),
-	iteminsession int4,
-	lastname varchar(256),
-	length numeric(18,0),
-	"level" varchar(256),
-	location varchar(256),
-	"method" varchar(256),
-	page varchar(256),
-	registration numeric(18,0),
-	sessionid int4,
-	song varchar(256),
-	status int4,
-	ts int8,
-	useragent varchar(256),
-	userid int4
-);
+CREATE TABLE IF NOT EXISTS songs (
+        songid varchar(256) ENCODE RAW NOT NULL PRIMARY KEY,
+        title varchar(256) ENCODE ZSTD,
+        artistid varchar(256) ENCODE ZSTD,
+        year int4 ENCODE AZ64,
+        duration numeric(18,0) ENCODE AZ64
+    )
+    DISTSTYLE KEY
+    DISTKEY (songid)
+    COMPOUND SORTKEY (songid);
 
-CREATE TABLE public.staging_songs (
-	num_songs int4,
-	artist_id varchar(256),
-	artist_name varchar(256),
-	artist_latitude numeric(18,0),
-	artist_longitude numeric(18,0),
-	artist_location varchar(256),
-	song_id varchar(256),
-	title varchar(256),
-	duration numeric(18,0),
-	"year" int4
-);
-
-CREATE TABLE public.staging_songs (
-	num_songs int4,
-	artist_id varchar(256),
-	artist_name varchar(256),
-	artist_latitude numeric(18,0),
-	artist_longitude numeric(18,0),
-	artist_location varchar(256),
-	song_id varchar(256),
-	title varchar(256),
-	duration numeric(18,0),
-	"year" int4
-);
-
-CREATE TABLE public.users (
-	userid int4 NOT NULL,
-	first_name varchar(256),
-	last_name varchar(256),
-	gender varchar(256),
-	"level" varchar(256),
-	CONSTRAINT users_pkey PRIMARY KEY (userid)
-);
+CREATE TABLE IF NOT EXISTS staging_events (
+        artist varchar(256) ENCODE ZSTD,
+        auth varchar(256) ENCODE ZSTD,
+        firstname varchar(256) ENCODE ZSTD,
+        gender varchar(256) ENCODE ZSTD,
+        iteminsession int4 ENCODE AZ64,
+        lastname varchar(256) ENCODE ZSTD,
+        length numeric(18,0) ENCODE AZ64,
+        level varchar(256) ENCODE ZSTD,
+        location varchar(256) ENCODE ZSTD,
+        method varchar(256) ENCODE ZSTD,
+        page varchar(256) ENCODE ZSTD,
+        registration numeric(18,0) ENCODE AZ64,
+        sessionid int4 ENCODE AZ64,
+        song varchar(256) ENCODE ZSTD,
+        status int4 ENCODE AZ64,
+        ts int8 ENCODE AZ64,
+        useragent varchar(256) ENCODE ZSTD,
+        userid int4 ENCODE AZ64
+    )
+    DISTSTYLE EVEN;
 
+CREATE TABLE IF NOT EXISTS staging_songs (
+        num_songs int4 ENCODE AZ64,
+        artist_id varchar(256) ENCODE ZSTD,
+        artist_name varchar(256) ENCODE ZSTD,
+        artist_latitude numeric(18,0) ENCODE AZ64,
+        artist_longitude numeric(18,0) ENCODE AZ64,
+        artist_location varchar(256) ENCODE ZSTD,
+        song_id varchar(256) ENCODE ZSTD,
+        title varchar(256) ENCODE ZSTD,
+        duration numeric(18,0) ENCODE AZ64,
+        year int4 ENCODE AZ64
+    )
+    DISTSTYLE EVEN;
 
+CREATE TABLE IF NOT EXISTS users (
+        userid int4 ENCODE RAW NOT NULL PRIMARY KEY,
+        first_name varchar(256) ENCODE ZSTD,
+        last_name varchar(256) ENCODE ZSTD,
+        gender varchar(256) ENCODE ZSTD,
+        level varchar(256) ENCODE ZSTD
+    )
+    DISTSTYLE ALL
+    COMPOUND SORTKEY (userid);
 
+CREATE TABLE IF NOT EXISTS hourly_plays (
+        hour_start timestamp ENCODE RAW NOT NULL,
+        level varchar(256) ENCODE ZSTD,
+        location varchar(256) ENCODE ZSTD,
+        plays int8 ENCODE AZ64 NOT NULL
+    )
+    DISTSTYLE ALL
+    COMPOUND SORTKEY (hour_start);
 
+CREATE TABLE IF NOT EXISTS daily_song_plays (
+        day_start timestamp ENCODE RAW NOT NULL,
+        songid varchar(256) ENCODE ZSTD,
+        artistid varchar(256) ENCODE ZSTD,
+        plays int8 ENCODE AZ64 NOT NULL
+    )
+    DISTSTYLE EVEN
+    COMPOUND SORTKEY (day_start);
 
+CREATE TABLE IF NOT EXISTS staging_loads (
+        table_name varchar(256) ENCODE ZSTD NOT NULL,
+        s3_key varchar(1024) ENCODE ZSTD NOT NULL,
+        etag varchar(256) ENCODE ZSTD NOT NULL,
+        loaded_at timestamp ENCODE AZ64 NOT NULL
+    )
+    DISTSTYLE ALL
+    COMPOUND SORTKEY (table_name);
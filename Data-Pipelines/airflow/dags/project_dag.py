@@ -31,7 +31,12 @@ stage_events_to_redshift = StageToRedshiftOperator(
     aws_credentials_id="aws_credentials",
     table="staging_events",
     s3_bucket="udacity-dend",
-    s3_key="log_data/*/*/*.json"
+    # log files hold a day of events, copied once by the first hourly run of the day and again only when they change
+    s3_key="log_data/{{ execution_date.strftime('%Y/%m') }}/{{ ds }}-events",
+    json_path="s3://udacity-dend/log_json_path.json",
+    window_column="ts",
+    # changed files are copied through a manifest of their exact keys, written to a bucket of ours
+    manifest_prefix="{{ var.value.staging_manifest_prefix }}"
 )
 
 stage_songs_to_redshift = StageToRedshiftOperator(
@@ -41,7 +46,7 @@ stage_songs_to_redshift = StageToRedshiftOperator(
     aws_credentials_id="aws_credentials",
     table="staging_songs",
     s3_bucket="udacity-dend",
-    s3_key="song_data/*/*/*/*.json'"
+    s3_key="song_data"
 )
 
 load_songplays_table = LoadFactOperator(
@@ -50,6 +55,8 @@ load_songplays_table = LoadFactOperator(
     redshift_conn_id="redshift",
     destination_table="songplays",
     sql_query=SqlQueries.songplay_table_insert,
+    summary_queries=[SqlQueries.hourly_plays_refresh, SqlQueries.daily_song_plays_refresh],
+    append_only=True,
 )
 
 load_user_dimension_table = LoadDimensionOperator(
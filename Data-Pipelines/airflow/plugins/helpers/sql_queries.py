@@ -1,7 +1,7 @@
 class SqlQueries:
     songplay_table_insert = ("""
         SELECT
-                md5(events.sessionid || events.start_time) songplay_id,
+                md5(events.sessionid || events.start_time) playid,
                 events.start_time, 
                 events.userid, 
                 events.level, 
@@ -12,7 +12,7 @@ class SqlQueries:
                 events.useragent
                 FROM (SELECT TIMESTAMP 'epoch' + ts/1000 * interval '1 second' AS start_time, *
             FROM staging_events
-            WHERE page='NextSong') events
+            WHERE page='NextSong' {window_filter}) events
             LEFT JOIN staging_songs songs
             ON events.song = songs.title
                 AND events.artist = songs.artist_name
@@ -39,4 +39,47 @@ class SqlQueries:
         SELECT start_time, extract(hour from start_time), extract(day from start_time), extract(week from start_time), 
                extract(month from start_time), extract(year from start_time), extract(dayofweek from start_time)
         FROM songplays
-    """)
\ No newline at end of file
+    """)
+
+    # summary tables refreshed by LoadFactOperator: only the hours and days of the staged events, narrowed to the
+    # execution window by window_filter when appending, are deleted and counted again from songplays, whose
+    # start_time sort key lets Redshift skip the blocks outside the batch
+    hourly_plays_refresh = ("""
+        DELETE FROM hourly_plays
+        USING (SELECT DISTINCT date_trunc('hour', TIMESTAMP 'epoch' + ts/1000 * interval '1 second') AS bucket
+            FROM staging_events
+            WHERE page='NextSong' {window_filter}) touched
+        WHERE hourly_plays.hour_start = touched.bucket;
+
+        INSERT INTO hourly_plays (hour_start, level, location, plays)
+        SELECT date_trunc('hour', songplays.start_time), songplays.level, songplays.location, COUNT(*)
+        FROM songplays
+        JOIN (SELECT DISTINCT date_trunc('hour', TIMESTAMP 'epoch' + ts/1000 * interval '1 second') AS bucket
+            FROM staging_events
+            WHERE page='NextSong' {window_filter}) touched
+            ON date_trunc('hour', songplays.start_time) = touched.bucket
+        WHERE songplays.start_time BETWEEN
+            (SELECT TIMESTAMP 'epoch' + MIN(ts)/1000 * interval '1 second' - interval '1 hour' FROM staging_events WHERE page='NextSong' {window_filter})
+            AND (SELECT TIMESTAMP 'epoch' + MAX(ts)/1000 * interval '1 second' + interval '1 hour' FROM staging_events WHERE page='NextSong' {window_filter})
+        GROUP BY 1, 2, 3;
+    """)
+
+    daily_song_plays_refresh = ("""
+        DELETE FROM daily_song_plays
+        USING (SELECT DISTINCT date_trunc('day', TIMESTAMP 'epoch' + ts/1000 * interval '1 second') AS bucket
+            FROM staging_events
+            WHERE page='NextSong' {window_filter}) touched
+        WHERE daily_song_plays.day_start = touched.bucket;
+
+        INSERT INTO daily_song_plays (day_start, songid, artistid, plays)
+        SELECT date_trunc('day', songplays.start_time), songplays.songid, songplays.artistid, COUNT(*)
+        FROM songplays
+        JOIN (SELECT DISTINCT date_trunc('day', TIMESTAMP 'epoch' + ts/1000 * interval '1 second') AS bucket
+            FROM staging_events
+            WHERE page='NextSong' {window_filter}) touched
+            ON date_trunc('day', songplays.start_time) = touched.bucket
+        WHERE songplays.start_time BETWEEN
+            (SELECT TIMESTAMP 'epoch' + MIN(ts)/1000 * interval '1 second' - interval '1 day' FROM staging_events WHERE page='NextSong' {window_filter})
+            AND (SELECT TIMESTAMP 'epoch' + MAX(ts)/1000 * interval '1 second' + interval '1 day' FROM staging_events WHERE page='NextSong' {window_filter})
+        GROUP BY 1, 2, 3;
+    """)
@@ -12,6 +12,11 @@ class LoadFactOperator(BaseOperator):
                  redshift_conn_id="",
                  destination_table="",
                  sql_query="",
+                 summary_queries=None,
+                 append_only=False,
+                 key_column="playid",
+                 window_column="start_time",
+                 order_by=("song_id", "artist_id"),
                  * args, **kwargs):
 
         super(LoadFactOperator, self).__init__(*args, **kwargs)
@@ -19,18 +24,63 @@ class LoadFactOperator(BaseOperator):
         self.redshift_conn_id = redshift_conn_id
         self.destination_table = destination_table
         self.sql_query = sql_query
+        self.summary_queries = summary_queries or []
+        self.append_only = append_only
+        self.key_column = key_column
+        self.window_column = window_column
+        self.order_by = list(order_by)
 
     def execute(self, context):
         redshift_hook = PostgresHook(self.redshift_conn_id)
 
-        self.log.info("Deleting all rows from {}".format(
-            self.destination_table))
-        redshift.run("DELETE FROM {}".format(self.destination_table))
-
-        self.log.info("Creating fact table")
-        redshift.run("""
-            CREATE TABLE {table} AS {sql_query}"""
-                     .format(
-                         table=self.destination_table,
-                         sql_query=self.sql_query
-                     ))
+        if self.append_only:
+            # only the events of the execution window are read, filtered on the staging ts so the filter reaches
+            # the scan of staging_events, and a row is inserted once per key and only when the key is not on the
+            # table yet. The existing keys are read for the window alone, a range of the sort key
+            window_filter = "AND ts >= {} AND ts < {}".format(
+                int(context["execution_date"].timestamp() * 1000),
+                int(context["next_execution_date"].timestamp() * 1000))
+            window_start = context["execution_date"].strftime("%Y-%m-%d %H:%M:%S")
+            window_end = context["next_execution_date"].strftime("%Y-%m-%d %H:%M:%S")
+            self.log.info("Appending new rows between {} and {} to {}".format(
+                window_start, window_end, self.destination_table))
+            redshift_hook.run("""
+                INSERT INTO {table}
+                SELECT batch.*
+                FROM ({sql_query}) batch
+                LEFT JOIN (
+                    SELECT {key}
+                    FROM {table}
+                    WHERE {column} >= '{start}' AND {column} < '{end}'
+                ) existing
+                ON existing.{key} = batch.{key}
+                WHERE existing.{key} IS NULL
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY batch.{key} ORDER BY {order_by}) = 1"""
+                              .format(
+                                  table=self.destination_table,
+                                  sql_query=self.sql_query.format(window_filter=window_filter),
+                                  key=self.key_column,
+                                  column=self.window_column,
+                                  start=window_start,
+                                  end=window_end,
+                                  order_by=", ".join("batch." + column for column in self.order_by)
+                              ))
+        else:
+            self.log.info("Deleting all rows from {}".format(
+                self.destination_table))
+            redshift_hook.run("DELETE FROM {}".format(self.destination_table))
+
+            self.log.info("Creating fact table")
+            redshift_hook.run("""
+                INSERT INTO {table} {sql_query}"""
+                              .format(
+                                  table=self.destination_table,
+                                  sql_query=self.sql_query.format(window_filter="")
+                              ))
+            window_filter = ""
+
+        # summary tables only count again the hours and days of the staged events, of the window when appending
+        if self.summary_queries:
+            self.log.info("Refreshing {} summary tables".format(len(self.summary_queries)))
+        for query in self.summary_queries:
+            redshift_hook.run(query.format(window_filter=window_filter))
@@ -1,12 +1,31 @@
+import json
+from datetime import datetime
 from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.hooks.postgres_hook import PostgresHook
+from airflow.hooks.S3_hook import S3Hook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
 
 class StageToRedshiftOperator(BaseOperator):
+    """
+    Copies the json files under s3_key, rendered from the execution date, to a staging table.
+    The key and ETag of every copied file are recorded on state_table, and only files that are new or whose
+    ETag changed are copied again. When there are none the COPY is skipped.
+
+    - Without window_column every file under s3_key is copied again into the emptied table when any of them changed
+
+    - With window_column, a column holding milliseconds since epoch like ts, only the changed files are copied,
+      through a manifest written under manifest_prefix that lists their exact keys, to a temporary table, and
+      replace the rows of the staging table between their first and last window_column, in one transaction.
+      Files are expected to cover ranges that don't overlap, like the daily log files, so a file copied by the
+      first hourly run of its day is not copied by the next ones. Rows of earlier windows are kept, the staging
+      table holds every file copied so far, since the dimensions are rebuilt from all of it
+    """
     ui_color = '#358140'
-    template_fields = ("s3_key",)
+    template_fields = ("s3_key", "manifest_prefix")
+    # keys recorded on state_table per statement, so the statements stay small on prefixes with many files
+    record_batch_size = 500
 
     @apply_defaults
     def __init__(self,
@@ -15,6 +34,10 @@ class StageToRedshiftOperator(BaseOperator):
                  table="",
                  s3_bucket="",
                  s3_key="",
+                 json_path="auto",
+                 window_column=None,
+                 state_table="staging_loads",
+                 manifest_prefix="",
                  *args, **kwargs):
 
         super(StageToRedshiftOperator, self).__init__(*args, **kwargs)
@@ -23,29 +46,117 @@ class StageToRedshiftOperator(BaseOperator):
         self.table = table
         self.s3_bucket = s3_bucket
         self.s3_key = s3_key
+        self.json_path = json_path
+        self.window_column = window_column
+        self.state_table = state_table
+        self.manifest_prefix = manifest_prefix
+
+    def list_files(self):
+        """
+        Returns the ETag of every file under s3_key.
+        """
+        s3 = S3Hook(aws_conn_id=self.aws_credentials_id).get_conn()
+        files = {}
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=self.s3_bucket, Prefix=self.s3_key):
+            for item in page.get("Contents", []):
+                files[item["Key"]] = item["ETag"].strip('"')
+        return files
+
+    def copy_sql(self, table, source, credentials, manifest=False):
+        """
+        Returns the COPY to table of the files under source, an s3:// prefix, or of the files listed by the
+        manifest at source.
+        """
+        return """
+            COPY {table}
+            FROM '{source}'
+            ACCESS_KEY_ID '{access_key}'
+            SECRET_ACCESS_KEY '{secret_key}'
+            json '{json_path}'{manifest};
+        """.format(
+            table=table,
+            source=source,
+            access_key=credentials.access_key,
+            secret_key=credentials.secret_key,
+            json_path=self.json_path,
+            manifest=" manifest" if manifest else ""
+        )
+
+    def write_manifest(self, keys, context):
+        """
+        Writes a COPY manifest listing the exact keys under manifest_prefix and returns its url.
+        """
+        url = "{}/{}/{}.manifest".format(self.manifest_prefix.rstrip("/"), self.table, context["ts_nodash"])
+        manifest = {"entries": [{"url": "s3://{}/{}".format(self.s3_bucket, key), "mandatory": True} for key in keys]}
+        S3Hook(aws_conn_id=self.aws_credentials_id).load_string(json.dumps(manifest), url, replace=True)
+        return url
+
+    def record_sql(self, files):
+        """
+        Returns the queries replacing the state of the given files, a dict of key and ETag, in batches of
+        record_batch_size keys.
+        """
+        quoted = sorted((key.replace("'", "''"), etag) for key, etag in files.items())
+        loaded_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        queries = []
+        for start in range(0, len(quoted), self.record_batch_size):
+            batch = quoted[start:start + self.record_batch_size]
+            queries.append("""
+            DELETE FROM {state_table} WHERE table_name = '{table}' AND s3_key IN ({keys});
+            INSERT INTO {state_table} (table_name, s3_key, etag, loaded_at) VALUES {values};
+            """.format(
+                state_table=self.state_table,
+                table=self.table,
+                keys=", ".join("'{}'".format(key) for key, _ in batch),
+                values=", ".join("('{}', '{}', '{}', '{}')".format(self.table, key, etag, loaded_at) for key, etag in batch)
+            ))
+        return "".join(queries)
 
     def execute(self, context):
-        aws_hook = AwsHook(self.aws_credentials_id)
-        credentials = aws_hook.get_credentials()
+        files = self.list_files()
+        if not files:
+            self.log.info("No files under s3://{}/{}, skipping the COPY".format(self.s3_bucket, self.s3_key))
+            return
+
         redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
+        loaded = dict(redshift.get_records(
+            "SELECT s3_key, etag FROM {} WHERE table_name = '{}' AND s3_key LIKE '{}%'".format(
+                self.state_table, self.table, self.s3_key.replace("'", "''"))
+        ))
+        changed = dict((key, etag) for key, etag in files.items() if loaded.get(key) != etag)
+        if not changed:
+            self.log.info("The {} files under s3://{}/{} were already copied to {}, skipping the COPY".format(
+                len(files), self.s3_bucket, self.s3_key, self.table))
+            return
+
+        credentials = AwsHook(self.aws_credentials_id).get_credentials()
+
+        if not self.window_column:
+            self.log.info("{} of {} files changed, copying s3://{}/{} to {} again".format(
+                len(changed), len(files), self.s3_bucket, self.s3_key, self.table))
+            redshift.run("DELETE FROM {};".format(self.table) +
+                         self.copy_sql(self.table, "s3://{}/{}".format(self.s3_bucket, self.s3_key), credentials) +
+                         self.record_sql(changed))
+            return
 
-        self.log.info("Deleting all rows from {}".format(self.table))
-        redshift.run("DELETE FROM {}".format(self.table))
+        if not self.manifest_prefix:
+            raise ValueError("Copying single files to {} needs manifest_prefix".format(self.table))
 
-        self.log.info("Copying data from S3 to Redshift")
-        rendered_key = self.s3_key.format(**context)
-        s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
+        self.log.info("Copying {} new or changed files of s3://{}/{} to {}".format(
+            len(changed), self.s3_bucket, self.s3_key, self.table))
+        manifest = self.write_manifest(sorted(changed), context)
         redshift.run("""
-            COPY {table}
-            FROM '{path}'
-            json 'auto'
-            ACCESS_KEY_ID '{access_key}'
-            SECRET_ACCESS_KEY '{secret_key}'
-            IGNOREHEADER 1
-            DELIMITER ','
+            CREATE TEMP TABLE {table}_files (LIKE {table});
+            {copy}
+            DELETE FROM {table}
+            USING (SELECT MIN({column}) AS first, MAX({column}) AS last FROM {table}_files) copied
+            WHERE {table}.{column} BETWEEN copied.first AND copied.last;
+            INSERT INTO {table} SELECT * FROM {table}_files;
+            DROP TABLE {table}_files;
+            {record}
         """.format(
             table=self.table,
-            path=s3_path,
-            access_key=credentials.access_key,
-            secret_key=credentials.secret_key
+            column=self.window_column,
+            copy=self.copy_sql(self.table + "_files", manifest, credentials, manifest=True),
+            record=self.record_sql(changed)
         ))
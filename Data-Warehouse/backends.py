@@ -0,0 +1,256 @@
+import glob
+import json
+import os
+import re
+import threading
+import zipfile
+
+
+BACKENDS = ["redshift", "duckdb", "postgres"]
+
+# zip archives shipped on Data-Lake/data and the dataset stored in each one
+ARCHIVES = {
+    "song_data": "song-data.zip",
+    "log_data": "log-data.zip",
+}
+
+# dataset every staging table is loaded from
+STAGING_DATASETS = {
+    "staging_events": "log_data",
+    "staging_songs": "song_data",
+}
+
+# python type json values of every staging column type are converted to, as COPY does
+COLUMN_TYPES = {
+    "int": int,
+    "bigint": int,
+    "numeric": float,
+    "varchar": str,
+}
+
+
+def translate(query, backend):
+    """
+    Rewrites the Redshift specific bits of a query for a local backend:
+
+    - physical design (ENCODE, DISTSTYLE, DISTKEY, SORTKEY) is dropped
+
+    - PRIMARY KEY is dropped, since Redshift doesn't enforce it and the full load relies on that
+
+    - IDENTITY columns become a sequence on duckdb and an identity column on postgres
+
+    - the epoch math keeps Redshift's integer division on duckdb and EXTRACT(WEEKDAY) becomes EXTRACT(DOW) on postgres
+
+    COPY can't be translated, the staging tables are loaded by load_staging instead.
+    """
+    if backend == "redshift":
+        return query
+    if re.match(r"\s*COPY\s", query, re.IGNORECASE):
+        raise ValueError("COPY only runs on redshift, load the staging tables with load_staging")
+
+    query = re.sub(r"\s+ENCODE\s+\w+", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\s+DISTSTYLE\s+\w+", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\s+DISTKEY\s*\([^)]*\)", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\s+(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)", "", query, flags=re.IGNORECASE)
+    query = re.sub(r"\s+PRIMARY KEY", "", query, flags=re.IGNORECASE)
+
+    identity = re.search(r"CREATE TABLE IF NOT EXISTS (\w+) \(\s*(\w+) INT IDENTITY\((\d+),\s*(\d+)\)", query, re.IGNORECASE)
+    if identity:
+        table, column, start, step = identity.groups()
+        if backend == "duckdb":
+            sequence = "{}_{}_seq".format(table, column)
+            query = "CREATE SEQUENCE IF NOT EXISTS {} START {} INCREMENT {} MINVALUE {};\n".format(sequence, start, step, start) + \
+                query.replace(identity.group(0), identity.group(0).split(" INT ")[0] + " INT DEFAULT nextval('{}')".format(sequence))
+        else:
+            query = query.replace(
+                identity.group(0),
+                identity.group(0).split(" INT ")[0] + " INT GENERATED BY DEFAULT AS IDENTITY (START WITH {} INCREMENT BY {} MINVALUE {})".format(start, step, start)
+            )
+
+    if backend == "duckdb":
+        query = re.sub(r"(\w+)/1000 \* INTERVAL", r"(\1 // 1000) * INTERVAL", query)
+    else:
+        query = re.sub(r"EXTRACT\(WEEKDAY FROM", "EXTRACT(DOW FROM", query, flags=re.IGNORECASE)
+    return query
+
+
+def iter_json_records(input_data, dataset, paths=None):
+    """
+    This function yields every json record of a dataset under input_data, read from the dataset folder
+    when it exists or straight from its zip archive otherwise. When paths are given only those files are read,
+    the archive itself being the only file of an archived dataset. Log files hold one record per line.
+    """
+    folder = os.path.join(input_data, dataset)
+    if os.path.isdir(folder):
+        sources = []
+        if paths is None:
+            paths = glob.glob(os.path.join(folder, "**", "*.json"), recursive=True)
+        for path in sorted(paths):
+            with open(path, "rb") as f:
+                sources.append(f.read())
+    elif paths is not None and not paths:
+        sources = []
+    else:
+        with zipfile.ZipFile(os.path.join(input_data, ARCHIVES[dataset])) as archive:
+            sources = [
+                archive.read(name) for name in sorted(archive.namelist())
+                if name.endswith(".json") and not name.startswith("__MACOSX")
+            ]
+
+    for raw in sources:
+        for line in raw.decode("utf-8").splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def staging_rows(records, columns):
+    """
+    This function turns json records into rows of the staging table columns, matched by name ignoring case
+    like COPY json 'auto' does, with values converted to the column type. Empty strings on number columns are loaded as NULL.
+    """
+    converters = [(name.lower(), COLUMN_TYPES[column_type]) for name, column_type, _ in columns]
+    for record in records:
+        record = dict((key.lower(), value) for key, value in record.items())
+        row = []
+        for name, convert in converters:
+            value = record.get(name)
+            row.append(None if value is None or (value == "" and convert is not str) else convert(value))
+        yield tuple(row)
+
+
+def load_staging(cur, backend, table, columns, input_data, paths=None):
+    """
+    This function loads a staging table from the local json files of its dataset, or only from paths,
+    in place of the Redshift COPY, and returns the number of rows loaded.
+    """
+    rows = list(staging_rows(iter_json_records(input_data, STAGING_DATASETS[table], paths), columns))
+    names = ", ".join(name for name, _, _ in columns)
+    if backend == "duckdb":
+        # row by row inserts are slow on duckdb, which scans arrow tables instead
+        import pyarrow as pa
+        arrow_types = {"int": pa.int32(), "bigint": pa.int64(), "numeric": pa.float64(), "varchar": pa.string()}
+        cur.insert_arrow(table, names, pa.table(
+            [pa.array([row[i] for row in rows], arrow_types[column_type]) for i, (_, column_type, _) in enumerate(columns)],
+            names=[name for name, _, _ in columns]
+        ))
+    else:
+        from psycopg2.extras import execute_values
+        execute_values(cur, "INSERT INTO {} ({}) VALUES %s".format(table, names), rows, page_size=1000)
+    return len(rows)
+
+
+class DuckDBConnection:
+    """
+    Gives a duckdb cursor the part of the psycopg2 connection interface the scripts use:
+    cursor() as a context manager, commit() and rollback(), with statements running in one transaction until commit.
+    """
+
+    def __init__(self, database):
+        self.conn = database.cursor()
+        self.in_transaction = False
+
+    def cursor(self):
+        if not self.in_transaction:
+            self.conn.execute("BEGIN TRANSACTION")
+            self.in_transaction = True
+        return DuckDBCursor(self.conn)
+
+    def commit(self):
+        if self.in_transaction:
+            self.conn.execute("COMMIT")
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self.conn.execute("ROLLBACK")
+            self.in_transaction = False
+
+    def close(self):
+        self.rollback()
+        self.conn.close()
+
+
+class DuckDBCursor:
+    """
+    Cursor of a DuckDBConnection, closing it leaves the connection open.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, parameters=None):
+        if parameters is None:
+            self.conn.execute(query)
+        else:
+            self.conn.execute(query, parameters)
+        # duckdb returns the rows changed by the last statement as its result, like psycopg2's rowcount
+        statements = [statement.strip() for statement in query.split(";") if statement.strip()]
+        self.rowcount = -1
+        if statements and statements[-1].upper().startswith(("INSERT", "DELETE", "UPDATE")):
+            self.rowcount = self.conn.fetchone()[0]
+
+    def insert_arrow(self, table, names, arrow_table):
+        self.conn.register("arrow_rows", arrow_table)
+        try:
+            self.conn.execute("INSERT INTO {} ({}) SELECT {} FROM arrow_rows".format(table, names, names))
+        finally:
+            self.conn.unregister("arrow_rows")
+
+    def fetchone(self):
+        return self.conn.fetchone()
+
+    def fetchall(self):
+        return self.conn.fetchall()
+
+    def close(self):
+        pass
+
+
+class DuckDBPool:
+    """
+    Pool of connections to one duckdb database file with the getconn/putconn/closeall interface of psycopg2's pools.
+    """
+
+    def __init__(self, path):
+        import duckdb
+        self.database = duckdb.connect(path)
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def getconn(self):
+        with self.lock:
+            return self.idle.pop() if self.idle else DuckDBConnection(self.database)
+
+    def putconn(self, conn):
+        with self.lock:
+            self.idle.append(conn)
+
+    def closeall(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+        self.database.close()
+
+
+def connection_pool(config, backend, max_connections):
+    """
+    Returns a pool of up to max_connections connections to the backend: the CLUSTER of dwh.cfg for redshift,
+    the DSN of the LOCAL section for postgres and the DUCKDB_PATH file of the LOCAL section for duckdb.
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {}. Use one of {}".format(backend, ", ".join(BACKENDS)))
+    if backend == "duckdb":
+        return DuckDBPool(config.get("LOCAL", "DUCKDB_PATH", fallback="sparkify.duckdb"))
+
+    from psycopg2.pool import ThreadedConnectionPool
+    if backend == "postgres":
+        return ThreadedConnectionPool(1, max_connections, config.get("LOCAL", "POSTGRES_DSN"))
+    return ThreadedConnectionPool(1, max_connections, "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
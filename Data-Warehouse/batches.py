@@ -0,0 +1,51 @@
+import json
+import os
+from datetime import datetime
+
+
+class LoadedFiles:
+    """
+    Input files merged into the tables by the incremental runs of one backend, with their size and, for local
+    files, their modification time, stored on a json file shared by the backends.
+    The batch of a run is every file that is not on it yet or that changed since it was loaded.
+    """
+
+    def __init__(self, path, backend):
+        self.path = path
+        self.backend = backend
+        self.files = self.load().get(backend, {})
+
+    def load(self):
+        """
+        This function returns the loaded files of every backend.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def new_files(self, table, files):
+        """
+        This function returns the files of a staging table, as (path, size, ...), that were not loaded yet
+        or changed since they were.
+        """
+        loaded = self.files.get(table, {})
+        return [file for file in files if loaded.get(file[0], {}).get("status") != list(file[1:])]
+
+    def mark_loaded(self, batch):
+        """
+        This function records the files of a batch, a dict of the files of every staging table, once it was merged,
+        keeping the ones of the other backends.
+        """
+        loaded_at = datetime.utcnow().isoformat()
+        for table, files in batch.items():
+            for file in files:
+                self.files.setdefault(table, {})[file[0]] = {"status": list(file[1:]), "loaded_at": loaded_at}
+
+        loaded = self.load()
+        loaded[self.backend] = self.files
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(loaded, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
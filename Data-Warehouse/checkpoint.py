@@ -0,0 +1,152 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+
+def files_fingerprint(files):
+    """
+    Returns a hash of a list of (name, size, ...) describing the input files of a step.
+    """
+    return hashlib.md5(json.dumps(sorted(files)).encode()).hexdigest()
+
+
+def local_files(input_data, dataset, archive):
+    """
+    This function returns the (path, size, modification time) of the json files of a dataset under input_data,
+    or of its zip archive when the dataset folder does not exist.
+    """
+    folder = os.path.join(input_data, dataset)
+    if os.path.isdir(folder):
+        paths = glob.glob(os.path.join(folder, "**", "*.json"), recursive=True)
+    else:
+        paths = [os.path.join(input_data, archive)]
+    return [(path, os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+
+
+def query_text(query):
+    """
+    Returns the text identifying a step's query: the sql itself, or the name and arguments of the function it calls.
+    """
+    if isinstance(query, str):
+        return query
+    func = getattr(query, "func", query)
+    keywords = sorted((key, repr(value)) for key, value in getattr(query, "keywords", {}).items())
+    return "{}({})".format(func.__name__, keywords)
+
+
+def step_fingerprints(steps, inputs):
+    """
+    Returns the fingerprint of every step: a hash of its query, of the fingerprint of its input files
+    on inputs, when it reads files, and of the fingerprints of the steps it depends on.
+    So a step gets a new fingerprint when its query, its files or anything it depends on changes.
+    """
+    queries = {name: (query, depends_on) for name, query, depends_on in steps}
+    fingerprints = {}
+
+    def fingerprint(name):
+        if name not in fingerprints:
+            query, depends_on = queries[name]
+            parts = [query_text(query), inputs.get(name, "")] + [fingerprint(dependency) for dependency in sorted(depends_on)]
+            fingerprints[name] = hashlib.md5("\n".join(parts).encode()).hexdigest()
+        return fingerprints[name]
+
+    for name in queries:
+        fingerprint(name)
+    return fingerprints
+
+
+def downstream(steps, start):
+    """
+    Returns start and every step that depends on it, directly or not.
+    """
+    selected = {start}
+    changed = True
+    while changed:
+        changed = False
+        for name, _, depends_on in steps:
+            if name not in selected and selected.intersection(depends_on):
+                selected.add(name)
+                changed = True
+    return selected
+
+
+class Checkpoint:
+    """
+    Completed steps of the runs on one backend, with their fingerprints, stored on a json file shared by the backends.
+    Every completed step is written right away, so a failed run keeps the steps it finished.
+    """
+
+    def __init__(self, path, backend):
+        self.path = path
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.steps = self.load().get(backend, {})
+
+    def load(self):
+        """
+        This function returns the checkpoints of every backend.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self):
+        """
+        This function writes the checkpoints of this backend, keeping the ones of the others.
+        """
+        checkpoints = self.load()
+        checkpoints[self.backend] = self.steps
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(checkpoints, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def is_done(self, name, fingerprint):
+        """
+        This function checks whether the step completed with the same fingerprint.
+        """
+        return self.steps.get(name, {}).get("fingerprint") == fingerprint
+
+    def mark_done(self, name, fingerprint):
+        """
+        This function records a completed step.
+        """
+        with self.lock:
+            self.steps[name] = {"fingerprint": fingerprint, "finished_at": datetime.utcnow().isoformat()}
+            self.save()
+
+    def clear(self):
+        """
+        This function forgets every step of the backend, e.g. once its tables were created again.
+        """
+        with self.lock:
+            self.steps = {}
+            self.save()
+
+
+def steps_to_skip(steps, fingerprints, checkpoint=None, only=None, from_step=None):
+    """
+    Returns the steps that don't run:
+
+    - with only, every step but the ones listed
+
+    - with from_step, every step but from_step and the steps depending on it
+
+    - otherwise, the steps completed on the checkpoint with the same fingerprint
+    """
+    names = [name for name, _, _ in steps]
+    for name in (only or []) + ([from_step] if from_step else []):
+        if name not in names:
+            raise ValueError("Unknown step {}. Steps are {}".format(name, ", ".join(names)))
+    if only:
+        return set(names) - set(only)
+    if from_step:
+        return set(names) - downstream(steps, from_step)
+    if checkpoint is None:
+        return set()
+    return set(name for name in names if checkpoint.is_done(name, fingerprints[name]))
@@ -1,23 +1,25 @@
+import argparse
 import configparser
-import psycopg2
+from backends import BACKENDS, connection_pool, translate
+from checkpoint import Checkpoint
 from sql_queries import create_table_queries, drop_table_queries
 
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, backend="redshift"):
     """
     This function executes queries that drop tables.
     """
     for query in drop_table_queries:
-        cur.execute(query)
+        cur.execute(translate(query, backend))
         conn.commit()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, backend="redshift"):
     """
-    This function executes queries that create tables.
+    This function executes queries that create tables, translated for local backends.
     """
     for query in create_table_queries:
-        cur.execute(query)
+        cur.execute(translate(query, backend))
         conn.commit()
 
 
@@ -25,25 +27,34 @@ def main():
     """
     - Reads dwh.cfg file
 
-    - Establishes connection with a Redshift database
+    - Establishes connection with a Redshift database, or with the local duckdb or postgres database of --backend
     
     - Drops all the tables.  
     
-    - Creates all tables needed. 
+    - Creates all tables needed, with the distribution, sort keys and encodings of physical_design.cfg. 
     
-    - Finally, closes the connection. 
+    - Finally, closes the connection and forgets the steps etl.py checkpointed on the backend. 
     """
         
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    parser = argparse.ArgumentParser(description="Creates the Sparkify tables")
+    parser.add_argument("--backend", choices=BACKENDS, default=config.get("ETL", "BACKEND", fallback="redshift"))
+    args = parser.parse_args()
+
+    pool = connection_pool(config, args.backend, 1)
+    conn = pool.getconn()
     cur = conn.cursor()
 
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+    drop_tables(cur, conn, args.backend)
+    create_tables(cur, conn, args.backend)
+
+    pool.putconn(conn)
+    pool.closeall()
 
-    conn.close()
+    # the steps etl.py completed before loaded tables that are gone now
+    Checkpoint(config.get("CHECKPOINT", "PATH", fallback="reports/checkpoint.json"), args.backend).clear()
 
 
 if __name__ == "__main__":
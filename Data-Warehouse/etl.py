@@ -1,50 +1,266 @@
+import argparse
 import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from functools import partial
+from backends import ARCHIVES, BACKENDS, STAGING_DATASETS, connection_pool, load_staging, translate
+from checkpoint import Checkpoint, files_fingerprint, local_files, step_fingerprints, steps_to_skip
+from executor import run_steps
+from history import RunHistory, print_summary
+from batches import LoadedFiles
+from swap import swap_steps
+from manifest import cluster_slices, copy_manifest, list_files, prepare_copy
+from sql_queries import appending_table_steps, copy_table_steps, insert_table_steps, truncate_table_steps, merge_table_steps, \
+    staging_events_manifest_copy, staging_songs_manifest_copy, LOG_DATA_FOLDER, SONG_DATA_FOLDER, TABLE_COLUMNS
 
 
-def load_staging_tables(cur, conn):
+def no_new_files(cur):
     """
-    This function executes queries that copy data from S3 files to amazon redshift tables.
+    This function stands for the COPY of a staging table without new files on the batch, which loads no rows.
     """
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+    return 0
 
 
-def insert_tables(cur, conn):
+def manifest_copy_steps(pool, config, dry_run, files):
     """
-    This function executes queries that select data from staging tables and insert on dimension/fact tables.
+    - Returns the staging COPY steps loading a manifest of the log and song files on files, bundling small files
+      when BUNDLE_SMALL_FILES is set. Every step writes its manifest when it runs, so the steps skipped by the
+      checkpoint don't read nor bundle any file. Tables without files load nothing
+
+    - On dry run, only prints the bytes every slice is expected to load and returns None
+    """
+    import boto3
+
+    slices = config.getint("COPY", "SLICES", fallback=0)
+    s3 = boto3.client("s3", region_name="us-west-2")
+    staging_prefix = config.get("COPY", "STAGING_PREFIX")
+    bundle = config.getboolean("COPY", "BUNDLE_SMALL_FILES", fallback=True)
+    target_bytes = config.getint("COPY", "TARGET_FILE_MB", fallback=64) * 1024 * 1024
+
+    if dry_run:
+        if not slices:
+            conn = pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    slices = cluster_slices(cur)
+            finally:
+                pool.putconn(conn)
+        for name in ["staging_events", "staging_songs"]:
+            if files[name]:
+                prepare_copy(s3, name, files[name], staging_prefix, slices, target_bytes, bundle, dry_run=True)
+        return None
+
+    steps = []
+    for name, query in [("staging_events", staging_events_manifest_copy), ("staging_songs", staging_songs_manifest_copy)]:
+        if not files[name]:
+            print("{}: no new files".format(name))
+            steps.append((name, no_new_files, []))
+            continue
+        # the client and the files stay positional, the checkpoint fingerprints the keywords and the files apart
+        steps.append((name, partial(
+            copy_manifest, s3, files[name], name=name, query=query, staging_url=staging_prefix,
+            slices=slices, target_bytes=target_bytes, bundle=bundle
+        ), []))
+    return steps
+
+
+def local_copy_steps(backend, input_data, files=None):
+    """
+    Returns the staging steps of a local backend, which load the json files or zip archives under input_data,
+    or only the ones on files, in place of the Redshift COPYs.
+    """
+    return [
+        (name, partial(
+            load_staging, backend=backend, table=name, columns=TABLE_COLUMNS[name], input_data=input_data,
+            paths=[file[0] for file in files[name]] if files is not None else None
+        ), depends_on)
+        for name, _, depends_on in copy_table_steps
+    ]
+
+
+def input_files(backend, input_data):
+    """
+    Returns the files every staging step loads: the S3 files under LOG_DATA and SONG_DATA as (url, size, ETag) on redshift,
+    the local files under input_data as (path, size, modification time) otherwise.
+    """
+    if backend == "redshift":
+        import boto3
+        s3 = boto3.client("s3", region_name="us-west-2")
+        return {"staging_events": list_files(s3, LOG_DATA_FOLDER), "staging_songs": list_files(s3, SONG_DATA_FOLDER)}
+    return dict(
+        (table, local_files(input_data, dataset, ARCHIVES[dataset])) for table, dataset in STAGING_DATASETS.items()
+    )
+
+
+def input_fingerprints(files):
+    """
+    Returns the fingerprint of the files every staging step, and the truncate before it, loads.
+    """
+    inputs = {}
+    for table, table_files in files.items():
+        inputs[table] = inputs["truncate_" + table] = files_fingerprint(table_files)
+    return inputs
+
+
+def load_steps(copy_steps, mode, swap=False, min_row_ratio=0.5):
+    """
+    Returns the steps of a full load, which inserts all the staging data, or of an incremental load,
+    which empties the staging tables before copying the batch, merges dimensions on their key
+    and appends the songplays not loaded yet, all the tables in one transaction.
+    With swap, the full load empties the staging tables too, builds shadow tables and swaps them with the live ones
+    once they pass the row count check.
+    """
+    if swap and mode != "full":
+        raise ValueError("SWAP needs MODE full, incremental loads already merge every table in one transaction")
+    if mode == "full" and not swap:
+        return copy_steps + insert_table_steps
+    if mode not in ["full", "incremental"]:
+        raise ValueError("Unknown MODE {}. Use full or incremental".format(mode))
+
+    # reloads start from empty staging tables
+    copy_steps = truncate_table_steps + [
+        (name, query, depends_on + ["truncate_" + name]) for name, query, depends_on in copy_steps
+    ]
+    if swap:
+        return swap_steps(copy_steps, insert_table_steps, min_row_ratio)
+    return copy_steps + merge_table_steps
+
+
+def empty_first(table, query, cur):
+    """
+    This function empties table and runs the function of its step on cur, so rerunning the step doesn't append its rows twice.
+    """
+    cur.execute("DELETE FROM {}".format(table))
+    return query(cur)
+
+
+def load_tables(pool, max_connections, steps, backend="redshift", history=None,
+                checkpoint=None, inputs=None, only=None, from_step=None, empty_reruns=False):
+    """
+    This function copies data from S3 files to the staging tables and inserts it on the dimension/fact tables.
+    Independent COPYs and inserts run at the same time over the pool, songplays waits for its inputs.
+    The queries are translated for local backends.
+
+    - With a RunHistory, the EXPLAIN plan of every query is captured, time regressions and plan changes against
+      the previous runs are flagged and the run is added to the history
+
+    - With a Checkpoint, every completed step is recorded with a fingerprint of its query, its input files
+      and its dependencies, and steps completed with the same fingerprint are skipped
+
+    - only runs just the listed steps and from_step reruns a step and every step after it. With empty_reruns,
+      set on full loads without SWAP, the tables of the appending steps they run are emptied first, in the same
+      transaction, so their rows are not loaded twice
     """
-    for query in insert_table_queries:
-        cur.execute(query)
-        conn.commit()
+    steps = [(name, query if callable(query) else translate(query, backend), depends_on) for name, query, depends_on in steps]
+    fingerprints = step_fingerprints(steps, inputs or {})
+    skip = steps_to_skip(steps, fingerprints, checkpoint, only, from_step)
+    if empty_reruns and (only or from_step):
+        # the fingerprints stay the ones of the plain steps, so later runs still skip them
+        steps = [
+            (name, query if name in skip or name not in appending_table_steps
+             else partial(empty_first, name, query) if callable(query)
+             else "DELETE FROM {};\n".format(name) + query, depends_on)
+            for name, query, depends_on in steps
+        ]
+    on_finish = None
+    if checkpoint is not None:
+        on_finish = lambda name: checkpoint.mark_done(name, fingerprints[name])
+    results = run_steps(pool, steps, max_connections, capture_plan=history is not None, skip=skip, on_finish=on_finish)
+    comparison = None
+    if history is not None:
+        comparison = history.compare(results)
+        history.record(results, comparison)
+    print_summary(steps, results, comparison)
 
 
 def main():
     """
     - Reads dwh.cfg file
 
-    - Establishes connection with a Redshift database
-    
-    - Loads data from S3 to Redshift 
-    
-    - Inserts data on Redsift tables
-    
-    - Finally, closes the connection. 
+    - Opens a pool of up to MAX_CONNECTIONS connections with a Redshift database, or with the local duckdb or
+      postgres database of --backend, which loads the staging tables from the local files under --input-data
+
+    - When STAGING_PREFIX is set, the staging COPYs load a manifest they write when they run, only the expected
+      bytes per slice are printed with --dry-run
+
+    - Loads data from S3 to Redshift and inserts data on Redsift tables, running independent steps concurrently.
+      In incremental MODE only the batch, the files under LOG_DATA and SONG_DATA not merged by a previous
+      incremental run as recorded on LOADED_FILES_PATH, is staged and merged into the tables in one transaction, with SWAP the full load builds shadow tables and swaps them with the live ones in one transaction
+
+    - Skips the steps completed by previous runs with the same queries and input files, recorded on the
+      checkpoint of the CHECKPOINT section, or runs only the --only steps or the steps from --from-step on
+
+    - Prints the time, rows and flags of every step and adds the run to the history of the HISTORY section
+
+    - Finally, closes the connections.
     """
-        
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    parser = argparse.ArgumentParser(description="Loads the Sparkify data from S3 into Redshift")
+    parser.add_argument("--dry-run", action="store_true", help="only print how the staging files spread over the slices")
+    parser.add_argument("--backend", choices=BACKENDS, default=config.get("ETL", "BACKEND", fallback="redshift"))
+    parser.add_argument("--input-data", default=config.get("LOCAL", "INPUT_DATA", fallback="../Data-Lake/data/"),
+                        help="folder with song_data and log_data, or their zip archives, for local backends")
+    parser.add_argument("--only", nargs="+", metavar="STEP", help="run only these steps")
+    parser.add_argument("--from-step", metavar="STEP", help="rerun this step and every step depending on it")
+    args = parser.parse_args()
+
+    max_connections = config.getint("ETL", "MAX_CONNECTIONS", fallback=1)
+    mode = config.get("ETL", "MODE", fallback="full")
+    swap = config.getboolean("ETL", "SWAP", fallback=False)
+    min_row_ratio = config.getfloat("ETL", "SWAP_MIN_ROW_RATIO", fallback=0.5)
+    use_manifest = args.backend == "redshift" and bool(config.get("COPY", "STAGING_PREFIX", fallback=""))
+    if args.dry_run and not use_manifest:
+        parser.error("--dry-run needs STAGING_PREFIX on the COPY section of dwh.cfg")
+    if mode == "incremental" and args.backend == "redshift" and not use_manifest:
+        parser.error("MODE=incremental loads the batch from a manifest and needs STAGING_PREFIX on the COPY section of dwh.cfg")
+
+    # the batch of an incremental run is every file not merged by the previous ones
+    loaded_files = None
+    files = None
+    if mode == "incremental":
+        loaded_files = LoadedFiles(config.get("ETL", "LOADED_FILES_PATH", fallback="reports/loaded_files.json"), args.backend)
+        files = dict(
+            (table, loaded_files.new_files(table, table_files))
+            for table, table_files in input_files(args.backend, args.input_data).items()
+        )
+        if not any(files.values()):
+            print("No new files since the last incremental run")
+            return
+        print("batch: " + ", ".join("{} new files for {}".format(len(table_files), table) for table, table_files in files.items()))
+
+    history = None
+    if config.getboolean("HISTORY", "ENABLED", fallback=True):
+        history = RunHistory(
+            config.get("HISTORY", "PATH", fallback="reports/query_history.jsonl"), args.backend,
+            runs=config.getint("HISTORY", "RUNS", fallback=5),
+            regression_factor=config.getfloat("HISTORY", "REGRESSION_FACTOR", fallback=1.5),
+            min_seconds=config.getfloat("HISTORY", "MIN_SECONDS", fallback=1.0),
+        )
+
+    checkpoint = None
+    if config.getboolean("CHECKPOINT", "ENABLED", fallback=True) and not args.dry_run:
+        checkpoint = Checkpoint(config.get("CHECKPOINT", "PATH", fallback="reports/checkpoint.json"), args.backend)
+
+    pool = connection_pool(config, args.backend, max_connections)
 
-    conn.close()
+    try:
+        if args.backend != "redshift":
+            copy_steps = local_copy_steps(args.backend, args.input_data, files)
+        elif use_manifest:
+            copy_steps = manifest_copy_steps(pool, config, args.dry_run, files or input_files(args.backend, args.input_data))
+        else:
+            copy_steps = copy_table_steps
+        if not args.dry_run:
+            load_tables(
+                pool, max_connections, load_steps(copy_steps, mode, swap, min_row_ratio), args.backend, history,
+                checkpoint, input_fingerprints(files or input_files(args.backend, args.input_data)) if checkpoint else None,
+                args.only, args.from_step, mode == "full" and not swap,
+            )
+            if loaded_files is not None:
+                loaded_files.mark_loaded(files)
+    finally:
+        pool.closeall()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,102 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# statements EXPLAIN can plan, COPY and TRUNCATE have no plan
+EXPLAINABLE = ("INSERT", "DELETE", "UPDATE", "SELECT")
+
+
+def split_statements(query):
+    """
+    Splits a query holding several statements separated by semicolons.
+    """
+    return [statement.strip() for statement in query.split(";") if statement.strip()]
+
+
+def explain(cur, query):
+    """
+    This function returns the EXPLAIN plan of every statement of a query that can be planned, one after the other.
+    """
+    plans = []
+    for statement in split_statements(query):
+        if statement.upper().startswith(EXPLAINABLE):
+            cur.execute("EXPLAIN " + statement)
+            plans.append("\n".join(str(row[-1]) for row in cur.fetchall()))
+    return "\n\n".join(plans)
+
+
+def execute_step(pool, name, query, capture_plan=False):
+    """
+    This function runs one query, or a function called with a cursor, on a connection borrowed from the pool and commits it.
+    Returns its duration in seconds, the rows it affected (of the last statement, as the driver reports them,
+    or the number returned by the function) and its EXPLAIN plan when capture_plan is set.
+    """
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            plan = explain(cur, query) if capture_plan and not callable(query) else None
+            start = time.time()
+            if callable(query):
+                rows = query(cur)
+            else:
+                cur.execute(query)
+                rows = cur.rowcount
+        conn.commit()
+        return {"seconds": time.time() - start, "rows": rows if rows is not None and rows >= 0 else None, "plan": plan}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_steps(pool, steps, max_workers, capture_plan=False, skip=(), on_finish=None):
+    """
+    - Runs steps, a list of (name, query, names of the steps it depends on), over the connection pool
+
+    - Steps on skip don't run and count as finished for the steps depending on them
+
+    - Each step starts as soon as its dependencies finished, with at most max_workers steps running at once,
+      and on_finish is called with its name once it committed
+
+    - If a step fails no other step is started, the running ones are waited for and the error is raised
+
+    - Returns the duration, rows and plan of every step that ran
+    """
+    pending = {name: (query, set(depends_on)) for name, query, depends_on in steps if name not in skip}
+    finished = set(name for name, _, _ in steps if name in skip)
+    results = {}
+    running = {}
+    error = None
+    for name in sorted(finished):
+        print("{} skipped".format(name))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if error is None:
+                ready = [name for name, (_, depends_on) in pending.items() if depends_on <= finished]
+                for name in ready[:max_workers - len(running)]:
+                    query, _ = pending.pop(name)
+                    running[executor.submit(execute_step, pool, name, query, capture_plan)] = name
+            elif not running:
+                break
+
+            if not running:
+                raise ValueError("Steps {} depend on steps that do not exist".format(", ".join(pending)))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    finished.add(name)
+                    print("{} finished in {:.2f}s".format(name, results[name]["seconds"]))
+                    if on_finish is not None:
+                        on_finish(name)
+                except Exception as e:
+                    print("{} failed: {}".format(name, e))
+                    error = error or e
+
+    if error is not None:
+        raise error
+    return results
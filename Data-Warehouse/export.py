@@ -0,0 +1,152 @@
+import argparse
+import configparser
+import os
+import shutil
+from datetime import datetime, timezone
+from functools import partial
+from backends import connection_pool, translate
+from executor import run_steps
+from history import print_summary
+from sql_queries import export_tables, incremental_export_tables, touched_partitions_select, DWH_ROLE_ARN
+
+
+EXPORT_BACKENDS = ["redshift", "duckdb"]
+
+
+def partition_path(partition_by, values):
+    """
+    Returns the hive style folder of a partition, e.g. year=2018/month=11.
+    """
+    return "/".join("{}={}".format(column, value) for column, value in zip(partition_by, values))
+
+
+def partition_query(query, columns, time_range, year, month):
+    """
+    Returns the query of the year/month partition, without its partition columns, which are on the folder name.
+    The table is filtered on time_range, a range of its sort key, inside query, so only the blocks of the month are read.
+    """
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    condition = time_range.format(
+        start=start.strftime("%Y-%m-%d %H:%M:%S"), end=end.strftime("%Y-%m-%d %H:%M:%S"),
+        start_ms=int(start.timestamp() * 1000), end_ms=int(end.timestamp() * 1000)
+    )
+    return "SELECT {} FROM ({} WHERE {}) as x".format(", ".join(columns), query.rstrip(), condition)
+
+
+def unload_sql(query, path, partition_by=None):
+    """
+    Returns the UNLOAD writing the result of query as parquet files under path, replacing the files already there,
+    and partitioned by partition_by.
+    """
+    sql = "UNLOAD ('{}')\n    TO '{}'\n    iam_role {}\n    FORMAT AS PARQUET".format(query.replace("'", "''"), path, DWH_ROLE_ARN)
+    if partition_by:
+        sql += "\n    PARTITION BY ({})".format(", ".join(partition_by))
+    return sql + "\n    CLEANPATH;"
+
+
+def duckdb_export(cur, query, path, partition_by=None):
+    """
+    This function writes the result of query as parquet files under the local folder path with duckdb,
+    replacing the files already there, and partitioned by partition_by.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    if partition_by:
+        cur.execute("COPY ({}) TO '{}' (FORMAT PARQUET, PARTITION_BY ({}))".format(query, path, ", ".join(partition_by)))
+    else:
+        os.makedirs(path)
+        cur.execute("COPY ({}) TO '{}' (FORMAT PARQUET)".format(query, os.path.join(path, "part-00000.parquet")))
+
+
+def export_step(backend, name, query, path, partition_by=None):
+    """
+    Returns the step exporting query to path on the backend.
+    """
+    query = translate(query, backend)
+    if backend == "redshift":
+        return (name, unload_sql(query, path, partition_by), [])
+    return (name, partial(duckdb_export, query=query, path=path, partition_by=partition_by), [])
+
+
+def export_steps(backend, output, touched, tables, full=False):
+    """
+    Returns the steps exporting every table of tables under output:
+
+    - songplays and time, unless full, only export the year/month partitions touched by the latest load,
+      each one replacing its own folder
+
+    - the other tables are exported whole, replacing their folder
+    """
+    steps = []
+    for table, folder, query, columns, partition_by in export_tables:
+        if table not in tables:
+            continue
+        path = output.rstrip("/") + "/" + folder
+        if table in incremental_export_tables and not full:
+            for values in touched:
+                steps.append(export_step(
+                    backend, "{}/{}".format(table, partition_path(partition_by, values)),
+                    partition_query(query, columns, incremental_export_tables[table], *values),
+                    path + "/" + partition_path(partition_by, values) + "/",
+                ))
+        else:
+            steps.append(export_step(backend, table, query, path + "/", partition_by))
+    return steps
+
+
+def touched_partitions(pool, backend):
+    """
+    This function returns the (year, month) of the events on staging_events, the batch of the latest load.
+    """
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(translate(touched_partitions_select, backend))
+            touched = [(int(year), int(month)) for year, month in cur.fetchall()]
+        conn.commit()
+        return touched
+    finally:
+        pool.putconn(conn)
+
+
+def main():
+    """
+    - Reads dwh.cfg file
+
+    - Finds the year/month partitions touched by the latest load from staging_events
+
+    - UNLOADs the star schema to parquet under the PATH of the EXPORT section, with the folders and partitions
+      of the Data-Lake tables, running the exports concurrently. With --backend duckdb, writes them to LOCAL_PATH instead
+
+    - Prints the time of every export
+    """
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    parser = argparse.ArgumentParser(description="Exports the star schema to partitioned parquet files")
+    parser.add_argument("--backend", choices=EXPORT_BACKENDS, default=config.get("ETL", "BACKEND", fallback="redshift"))
+    parser.add_argument("--tables", nargs="+", default=[table for table, _, _, _, _ in export_tables])
+    parser.add_argument("--full", action="store_true", help="export every partition of songplays and time")
+    args = parser.parse_args()
+
+    if args.backend == "redshift":
+        output = config.get("EXPORT", "PATH", fallback="")
+        if not output.startswith("s3://"):
+            parser.error("Set PATH on the EXPORT section of dwh.cfg to the s3:// folder the star schema is unloaded to")
+    else:
+        output = config.get("EXPORT", "LOCAL_PATH", fallback="exports/")
+    max_connections = config.getint("ETL", "MAX_CONNECTIONS", fallback=1)
+    pool = connection_pool(config, args.backend, max_connections)
+
+    try:
+        touched = touched_partitions(pool, args.backend)
+        print("partitions touched by the latest load: {}".format(", ".join("{}-{:02d}".format(*values) for values in touched) or "none"))
+        steps = export_steps(args.backend, output, touched, args.tables, args.full)
+        results = run_steps(pool, steps, max_connections)
+        print_summary(steps, results)
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
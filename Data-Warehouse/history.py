@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import statistics
+from datetime import datetime
+
+
+# Redshift data movement and join steps worth flagging when they show up on a plan, e.g. on the songplays join
+EXPENSIVE_STEPS = ["DS_BCAST_INNER", "DS_DIST_BOTH", "DS_DIST_ALL_INNER", "DS_DIST_INNER", "DS_DIST_OUTER", "Nested Loop"]
+
+
+def plan_signature(plan):
+    """
+    Returns a hash of the shape of a plan: costs, row estimates and other numbers are left out, and so is the
+    _shadow suffix of the tables built by SWAP loads, so the signature only changes when the steps of the plan change.
+    """
+    shape = re.sub(r"\(cost=[^)]*\)", "", plan)
+    shape = re.sub(r"_shadow\b", "", shape)
+    shape = re.sub(r"\d+(\.\d+)?", "#", shape)
+    shape = re.sub(r"\s+", " ", shape).strip()
+    return hashlib.md5(shape.encode()).hexdigest()[:12]
+
+
+def plan_steps(plan):
+    """
+    Returns the expensive steps found on a plan.
+    """
+    return [step for step in EXPENSIVE_STEPS if step in plan]
+
+
+class RunHistory:
+    """
+    Run history of the warehouse steps, stored as one json line per run on path.
+
+    - compare flags the steps of a run that got slower than regression_factor times the median of their
+      previous runs on the same backend, by at least min_seconds, and the steps whose plan changed since their last run
+
+    - record appends the run to the history
+    """
+
+    def __init__(self, path, backend, runs=5, regression_factor=1.5, min_seconds=1.0):
+        self.path = path
+        self.backend = backend
+        self.runs = runs
+        self.regression_factor = regression_factor
+        self.min_seconds = min_seconds
+
+    def load(self):
+        """
+        This function returns the previous runs on the same backend, oldest first.
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        return [run for run in runs if run["backend"] == self.backend]
+
+    def compare(self, results):
+        """
+        This function returns, for every step of results, the median time of its previous runs and its flags.
+        """
+        history = self.load()
+        comparison = {}
+        for name, result in results.items():
+            previous = [run["steps"][name] for run in history if name in run["steps"]][-self.runs:]
+            baseline = statistics.median(step["seconds"] for step in previous) if previous else None
+            flags = []
+            if baseline is not None and result["seconds"] > baseline * self.regression_factor \
+                    and result["seconds"] - baseline >= self.min_seconds:
+                flags.append("slower x{:.1f}".format(result["seconds"] / baseline if baseline else float("inf")))
+
+            last_plan = next((step for step in reversed(previous) if step.get("plan_signature")), None)
+            if result.get("plan") and last_plan and plan_signature(result["plan"]) != last_plan["plan_signature"]:
+                new_steps = [step for step in plan_steps(result["plan"]) if step not in last_plan["plan_steps"]]
+                flags.append("plan changed" + (": new " + ", ".join(new_steps) if new_steps else ""))
+            comparison[name] = {"baseline": baseline, "flags": flags}
+        return comparison
+
+    def record(self, results, comparison, **run_info):
+        """
+        This function appends the run, with the time, rows, plan and flags of every step, to the history.
+        """
+        steps = {}
+        for name, result in results.items():
+            steps[name] = {
+                "seconds": round(result["seconds"], 3),
+                "rows": result["rows"],
+                "plan": result.get("plan"),
+                "plan_signature": plan_signature(result["plan"]) if result.get("plan") else None,
+                "plan_steps": plan_steps(result["plan"]) if result.get("plan") else [],
+                "flags": comparison[name]["flags"],
+            }
+        run = dict(run_info, run_at=datetime.utcnow().isoformat(), backend=self.backend, steps=steps)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+
+def print_summary(steps, results, comparison=None):
+    """
+    This function prints the time, rows, median of the previous runs and flags of every step in the order they were declared.
+    """
+    comparison = comparison or {}
+    print("{:<24} {:>10} {:>12} {:>10}  {}".format("step", "seconds", "rows", "median", "flags"))
+    for name, _, _ in steps:
+        result = results.get(name)
+        step = comparison.get(name, {"baseline": None, "flags": []})
+        print("{:<24} {:>10} {:>12} {:>10}  {}".format(
+            name,
+            "{:.2f}".format(result["seconds"]) if result else "-",
+            result["rows"] if result and result["rows"] is not None else "-",
+            "{:.2f}".format(step["baseline"]) if step["baseline"] is not None else "-",
+            ", ".join(step["flags"]),
+        ))
@@ -0,0 +1,160 @@
+import hashlib
+import heapq
+import json
+import math
+
+
+def parse_s3_url(url):
+    """
+    Splits an s3://bucket/prefix url, quoted or not as on dwh.cfg, into bucket and prefix.
+    """
+    url = url.strip("'\"")
+    if not url.startswith("s3://"):
+        raise ValueError("{} is not an s3:// url".format(url))
+    bucket, _, prefix = url[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_files(s3, url):
+    """
+    This function lists every non empty file under an S3 prefix and returns their (url, size in bytes, ETag).
+    """
+    bucket, prefix = parse_s3_url(url)
+    files = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Size"] > 0 and not item["Key"].endswith("/"):
+                files.append(("s3://{}/{}".format(bucket, item["Key"]), item["Size"], item["ETag"].strip('"')))
+    return files
+
+
+def cluster_slices(cur):
+    """
+    This function returns the number of slices of the cluster, which load the COPY files in parallel.
+    """
+    cur.execute("SELECT COUNT(*) FROM stv_slices")
+    return cur.fetchone()[0]
+
+
+def assign(files, bins):
+    """
+    Spreads (url, size, ...) files over bins, the largest file first into the least loaded bin,
+    and returns the files of every bin.
+    """
+    heap = [(0, i) for i in range(bins)]
+    assigned = [[] for _ in range(bins)]
+    for file in sorted(files, key=lambda f: f[1], reverse=True):
+        load, i = heapq.heappop(heap)
+        assigned[i].append(file)
+        heapq.heappush(heap, (load + file[1], i))
+    return assigned
+
+
+def plan_bundles(files, slices, target_bytes):
+    """
+    Returns the files to concatenate into every bundle when the files are smaller than target_bytes on average,
+    otherwise None.
+    The number of bundles is a multiple of slices, so every slice loads the same number of bundles of similar size.
+    """
+    total = sum(file[1] for file in files)
+    if not files or total / len(files) >= target_bytes:
+        return None
+    bundles = slices * max(1, math.ceil(total / target_bytes / slices))
+    return [bundle for bundle in assign(files, min(bundles, len(files))) if bundle]
+
+
+def write_bundles(s3, bundles, staging_url, name):
+    """
+    This function concatenates the files of every bundle into one newline separated JSON file under staging_url
+    and returns the (url, size) of the bundles.
+    Bundles are named after a hash of the url, size and ETag of their files, so a bundle written by a previous run
+    with the same files is already there and is not downloaded and uploaded again, while a rewritten file gets a new bundle.
+    """
+    bucket, prefix = parse_s3_url(staging_url)
+    folder = "{}/{}/bundles".format(prefix.rstrip("/"), name)
+    existing = dict((file[0], file[1]) for file in list_files(s3, "s3://{}/{}/".format(bucket, folder)))
+    written = []
+    reused = 0
+    for bundle in bundles:
+        bundle = sorted(bundle)
+        key = "{}/{}.json".format(folder, hashlib.md5(json.dumps(bundle).encode()).hexdigest())
+        url = "s3://{}/{}".format(bucket, key)
+        if url in existing:
+            written.append((url, existing[url]))
+            reused += 1
+            continue
+        parts = []
+        for file in bundle:
+            file_bucket, file_key = parse_s3_url(file[0])
+            parts.append(s3.get_object(Bucket=file_bucket, Key=file_key)["Body"].read().rstrip(b"\n"))
+        body = b"\n".join(parts) + b"\n"
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+        written.append((url, len(body)))
+    print("{}: {} bundles written, {} unchanged".format(name, len(bundles) - reused, reused))
+    return written
+
+
+def write_manifest(s3, files, staging_url, name):
+    """
+    This function writes a COPY manifest listing every file as mandatory, with its content_length, and returns its url.
+    """
+    bucket, prefix = parse_s3_url(staging_url)
+    manifest = {
+        "entries": [{"url": file[0], "mandatory": True, "meta": {"content_length": file[1]}} for file in files]
+    }
+    key = "{}/{}/{}.manifest".format(prefix.rstrip("/"), name, name)
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode())
+    return "s3://{}/{}".format(bucket, key)
+
+
+def print_balance(name, files, slices):
+    """
+    This function prints the bytes every slice is expected to load when the files are spread evenly over the slices,
+    and the ratio between the most and the average loaded slice.
+    """
+    loads = [sum(file[1] for file in files) for files in assign(files, slices)]
+    average = sum(loads) / slices if slices else 0
+    print("{}: {} files, {} bytes over {} slices".format(name, len(files), sum(loads), slices))
+    for i, load in enumerate(loads):
+        print("    slice {:<4} {:>14} bytes".format(i, load))
+    print("    max/avg {:.2f}".format(max(loads) / average if average else 0))
+
+
+def prepare_copy(s3, name, files, staging_url, slices, target_bytes, bundle=True, dry_run=False):
+    """
+    - Takes the (url, size, ETag) files to load, listed by list_files
+
+    - If bundle is set and the files are small, plans bundles of about target_bytes, as many as a multiple of slices
+
+    - Prints the expected bytes per slice
+
+    - Unless dry_run, writes the bundles and a manifest of the files to load under staging_url and returns its url
+    """
+    if not files:
+        raise ValueError("No files to load into {}".format(name))
+
+    bundles = plan_bundles(files, slices, target_bytes) if bundle else None
+    if bundles is not None:
+        planned = [("bundle-{}".format(i), sum(file[1] for file in files)) for i, files in enumerate(bundles)]
+        print("{}: bundling {} files into {} files".format(name, len(files), len(bundles)))
+        print_balance(name, planned, slices)
+    else:
+        print_balance(name, files, slices)
+
+    if dry_run:
+        return None
+    if bundles is not None:
+        files = write_bundles(s3, bundles, staging_url, name)
+    return write_manifest(s3, files, staging_url, name)
+
+
+def copy_manifest(s3, files, cur, name, query, staging_url, slices, target_bytes, bundle=True):
+    """
+    This function prepares the manifest of files, as prepare_copy does, and runs the COPY query formatted with its url.
+    It is the staging step itself, so the files are only bundled when the step runs and not when the checkpoint skips it.
+    With slices 0 the slices of the cluster are counted. Returns the rows loaded.
+    """
+    if not slices:
+        slices = cluster_slices(cur)
+    cur.execute(query.format(prepare_copy(s3, name, files, staging_url, slices, target_bytes, bundle)))
+    return cur.rowcount
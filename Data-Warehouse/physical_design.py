@@ -0,0 +1,140 @@
+import argparse
+import configparser
+import psycopg2
+
+
+DISTSTYLES = ["AUTO", "EVEN", "KEY", "ALL"]
+
+
+def split_values(value):
+    """
+    Splits a comma separated list from physical_design.cfg, an empty value means no values.
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def load_design(path):
+    """
+    Reads the physical design of every table from path, a file with one section per table:
+
+    - DISTSTYLE is AUTO, EVEN, KEY or ALL, and KEY needs the DISTKEY column
+
+    - SORTKEY is a comma separated list of columns of a compound sort key
+
+    - ENCODE is a comma separated list of column:encoding pairs, columns left out get Redshift's default encoding
+
+    Tables without a section are created with Redshift's defaults.
+    """
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError("Physical design spec {} not found".format(path))
+
+    design = {}
+    for table in config.sections():
+        section = config[table]
+        diststyle = section.get("DISTSTYLE", "AUTO").upper()
+        if diststyle not in DISTSTYLES:
+            raise ValueError("Unknown DISTSTYLE {} for {}. Use one of {}".format(diststyle, table, ", ".join(DISTSTYLES)))
+        if diststyle == "KEY" and not section.get("DISTKEY"):
+            raise ValueError("DISTSTYLE KEY for {} needs a DISTKEY".format(table))
+        design[table] = {
+            "diststyle": diststyle,
+            "distkey": section.get("DISTKEY", ""),
+            "sortkey": split_values(section.get("SORTKEY", "")),
+            "encode": dict(
+                (column.strip().lower(), encoding.strip().upper())
+                for column, encoding in (pair.split(":") for pair in split_values(section.get("ENCODE", "")))
+            ),
+        }
+    return design
+
+
+def create_table_sql(table, columns, design):
+    """
+    Returns the CREATE TABLE statement of table, from its (name, type, constraints) columns
+    and the encodings, distribution and sort key of its physical design.
+    """
+    table_design = design.get(table, {"diststyle": "AUTO", "distkey": "", "sortkey": [], "encode": {}})
+    names = [name.lower() for name, _, _ in columns]
+    for column in [table_design["distkey"]] + table_design["sortkey"] + list(table_design["encode"]):
+        if column and column.lower() not in names:
+            raise ValueError("Column {} of the physical design of {} does not exist".format(column, table))
+
+    definitions = []
+    for name, column_type, constraints in columns:
+        # Redshift expects the encoding between the type and the column constraints
+        encoding = table_design["encode"].get(name.lower())
+        definitions.append(" ".join(part for part in [name, column_type, "ENCODE " + encoding if encoding else "", constraints] if part))
+
+    sql = "CREATE TABLE IF NOT EXISTS {} (\n        {}\n    )\n    DISTSTYLE {}".format(
+        table, ",\n        ".join(definitions), table_design["diststyle"]
+    )
+    if table_design["diststyle"] == "KEY":
+        sql += "\n    DISTKEY ({})".format(table_design["distkey"])
+    if table_design["sortkey"]:
+        sql += "\n    COMPOUND SORTKEY ({})".format(", ".join(table_design["sortkey"]))
+    return sql
+
+
+def analyze_compression(cur, table, sample_rows):
+    """
+    This function runs ANALYZE COMPRESSION on sample_rows rows of a loaded table and returns the recommended encoding of every column.
+    """
+    cur.execute("ANALYZE COMPRESSION {} COMPROWS {}".format(table, sample_rows))
+    return dict((column.lower(), encoding.upper()) for _, column, encoding, _ in cur.fetchall())
+
+
+def save_encodings(path, recommendations):
+    """
+    This function writes the recommended encodings of every table into the ENCODE entry of its section on path.
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(path)
+    for table, encodings in recommendations.items():
+        if not config.has_section(table):
+            config.add_section(table)
+        config.set(table, "ENCODE", ",".join("{}:{}".format(column, encoding.lower()) for column, encoding in encodings.items()))
+    with open(path, "w") as f:
+        config.write(f, space_around_delimiters=False)
+
+
+def main():
+    """
+    - Reads dwh.cfg file
+
+    - Runs ANALYZE COMPRESSION on a sample of every table, which must already be loaded, e.g. by etl.py on a sample of the data
+
+    - Prints the recommended encodings and, unless --dry-run, writes them to the physical design spec,
+      so the next create_tables.py creates the tables with them
+    """
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    spec = config.get("DESIGN", "SPEC", fallback="physical_design.cfg")
+
+    parser = argparse.ArgumentParser(description="Feeds Redshift's recommended column encodings back into the physical design spec")
+    parser.add_argument("--tables", nargs="+", default=list(load_design(spec)))
+    parser.add_argument("--sample-rows", type=int, default=100000)
+    parser.add_argument("--dry-run", action="store_true", help="only print the recommendations")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    # ANALYZE COMPRESSION can't run inside a transaction block
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    recommendations = {}
+    for table in args.tables:
+        recommendations[table] = analyze_compression(cur, table, args.sample_rows)
+        for column, encoding in recommendations[table].items():
+            print("{:<16} {:<20} {}".format(table, column, encoding))
+
+    conn.close()
+
+    if not args.dry_run:
+        save_encodings(spec, recommendations)
+        print("Encodings written to {}, run create_tables.py to apply them".format(spec))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import configparser
+from physical_design import load_design, create_table_sql
 
 
 # CONFIG
@@ -14,102 +15,118 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+song_match_table_drop = "DROP TABLE IF EXISTS song_matches"
+hourly_plays_table_drop = "DROP TABLE IF EXISTS hourly_plays"
+daily_song_plays_table_drop = "DROP TABLE IF EXISTS daily_song_plays"
 
 # CREATE TABLES
+# column name, type and constraints of every table, the distribution, sort keys and encodings come from physical_design.cfg
 
-staging_events_table_create= ("""
-    CREATE TABLE IF NOT EXISTS staging_events (
-        artist varchar,
-        auth varchar,
-        firstName varchar,
-        gender varchar,
-        itemInSession int,
-        lastName varchar,
-        length numeric,
-        level varchar,
-        location varchar,
-        method varchar,
-        page varchar,
-        registration numeric,
-        sessionId int,
-        song varchar,
-        status int,
-        ts bigint,
-        userAgent varchar,
-        userId int
-    )
-""")
-
-staging_songs_table_create = ("""
-    CREATE TABLE IF NOT EXISTS staging_songs (
-        num_songs int,
-            artist_id varchar,
-        artist_latitude numeric,
-        artist_longitude numeric,
-        artist_location varchar,
-        artist_name varchar,
-        song_id varchar,
-        title varchar,
-        duration numeric,
-        year int
-    )
-""")
-
-songplay_table_create = ("""
-    CREATE TABLE IF NOT EXISTS songplays (
-        songplay_id INT IDENTITY(0,1) PRIMARY KEY,
-        start_time bigint NOT NULL,
-        user_id int NOT NULL,
-        level varchar,
-        song_id varchar NOT NULL,
-        artist_id varchar NOT NULL,
-        session_id int,
-        location varchar,
-        user_agent varchar
-    )
-""")
+TABLE_COLUMNS = {
+    "staging_events": [
+        ("artist", "varchar", ""),
+        ("auth", "varchar", ""),
+        ("firstName", "varchar", ""),
+        ("gender", "varchar", ""),
+        ("itemInSession", "int", ""),
+        ("lastName", "varchar", ""),
+        ("length", "numeric", ""),
+        ("level", "varchar", ""),
+        ("location", "varchar", ""),
+        ("method", "varchar", ""),
+        ("page", "varchar", ""),
+        ("registration", "numeric", ""),
+        ("sessionId", "int", ""),
+        ("song", "varchar", ""),
+        ("status", "int", ""),
+        ("ts", "bigint", ""),
+        ("userAgent", "varchar", ""),
+        ("userId", "int", ""),
+    ],
+    "staging_songs": [
+        ("num_songs", "int", ""),
+        ("artist_id", "varchar", ""),
+        ("artist_latitude", "numeric", ""),
+        ("artist_longitude", "numeric", ""),
+        ("artist_location", "varchar", ""),
+        ("artist_name", "varchar", ""),
+        ("song_id", "varchar", ""),
+        ("title", "varchar", ""),
+        ("duration", "numeric", ""),
+        ("year", "int", ""),
+    ],
+    "songplays": [
+        ("songplay_id", "INT IDENTITY(0,1)", "PRIMARY KEY"),
+        ("start_time", "bigint", "NOT NULL"),
+        ("user_id", "int", "NOT NULL"),
+        ("level", "varchar", ""),
+        ("song_id", "varchar", "NOT NULL"),
+        ("artist_id", "varchar", "NOT NULL"),
+        ("session_id", "int", ""),
+        ("location", "varchar", ""),
+        ("user_agent", "varchar", ""),
+    ],
+    "users": [
+        ("user_id", "int", "PRIMARY KEY"),
+        ("first_name", "varchar", ""),
+        ("last_name", "varchar", ""),
+        ("gender", "varchar", ""),
+        ("level", "varchar", ""),
+    ],
+    "songs": [
+        ("song_id", "varchar", "PRIMARY KEY"),
+        ("title", "varchar", ""),
+        ("artist_id", "varchar", "NOT NULL"),
+        ("year", "int", ""),
+        ("duration", "numeric", ""),
+    ],
+    "artists": [
+        ("artist_id", "varchar", "PRIMARY KEY"),
+        ("name", "varchar", ""),
+        ("location", "varchar", ""),
+        ("latitude", "numeric", ""),
+        ("longitude", "numeric", ""),
+    ],
+    "time": [
+        ("start_time", "TIMESTAMP", "PRIMARY KEY"),
+        ("hour", "int", ""),
+        ("day", "int", ""),
+        ("week", "int", ""),
+        ("month", "int", ""),
+        ("year", "int", ""),
+        ("weekday", "varchar", ""),
+    ],
+    "song_matches": [
+        ("match_key", "char(32)", "NOT NULL"),
+        ("song_id", "varchar", "NOT NULL"),
+        ("artist_id", "varchar", "NOT NULL"),
+    ],
+    "hourly_plays": [
+        ("hour_start", "TIMESTAMP", "NOT NULL"),
+        ("level", "varchar", ""),
+        ("location", "varchar", ""),
+        ("plays", "bigint", "NOT NULL"),
+    ],
+    "daily_song_plays": [
+        ("day_start", "TIMESTAMP", "NOT NULL"),
+        ("song_id", "varchar", "NOT NULL"),
+        ("artist_id", "varchar", "NOT NULL"),
+        ("plays", "bigint", "NOT NULL"),
+    ],
+}
 
-user_table_create = ("""
-    CREATE TABLE IF NOT EXISTS users (
-        user_id int PRIMARY KEY,
-        first_name varchar,
-        last_name varchar,
-        gender varchar,
-        level varchar
-    )
-""")
+PHYSICAL_DESIGN = load_design(config.get("DESIGN", "SPEC", fallback="physical_design.cfg"))
 
-song_table_create = ("""
-    CREATE TABLE IF NOT EXISTS songs (
-        song_id varchar PRIMARY KEY,
-        title varchar,
-        artist_id varchar NOT NULL,
-        year int,
-        duration numeric
-    )
-""")
-
-artist_table_create = ("""
-    CREATE TABLE IF NOT EXISTS artists (
-        artist_id varchar PRIMARY KEY,
-        name varchar,
-        location varchar,
-        latitude numeric,
-        longitude numeric
-    )
-""")
-
-time_table_create = ("""
-    CREATE TABLE IF NOT EXISTS time (
-        start_time TIMESTAMP PRIMARY KEY,
-        hour int,
-        day int,
-        week int,
-        month int,
-        year int,
-        weekday varchar
-    )
-""")
+staging_events_table_create = create_table_sql("staging_events", TABLE_COLUMNS["staging_events"], PHYSICAL_DESIGN)
+staging_songs_table_create = create_table_sql("staging_songs", TABLE_COLUMNS["staging_songs"], PHYSICAL_DESIGN)
+songplay_table_create = create_table_sql("songplays", TABLE_COLUMNS["songplays"], PHYSICAL_DESIGN)
+user_table_create = create_table_sql("users", TABLE_COLUMNS["users"], PHYSICAL_DESIGN)
+song_table_create = create_table_sql("songs", TABLE_COLUMNS["songs"], PHYSICAL_DESIGN)
+artist_table_create = create_table_sql("artists", TABLE_COLUMNS["artists"], PHYSICAL_DESIGN)
+time_table_create = create_table_sql("time", TABLE_COLUMNS["time"], PHYSICAL_DESIGN)
+song_match_table_create = create_table_sql("song_matches", TABLE_COLUMNS["song_matches"], PHYSICAL_DESIGN)
+hourly_plays_table_create = create_table_sql("hourly_plays", TABLE_COLUMNS["hourly_plays"], PHYSICAL_DESIGN)
+daily_song_plays_table_create = create_table_sql("daily_song_plays", TABLE_COLUMNS["daily_song_plays"], PHYSICAL_DESIGN)
 
 # STAGING TABLES
 
@@ -134,8 +151,55 @@ staging_songs_copy = """
     json 'auto' compupdate off region 'us-west-2';
 """.format(SONG_DATA_FOLDER, DWH_ROLE_ARN)
 
+# copies of the files listed on a manifest built by manifest.py, formatted with the manifest url
+
+staging_events_manifest_copy = (
+"""
+    COPY staging_events FROM '{{}}'
+    iam_role {}
+    json {}
+    manifest compupdate off region 'us-west-2';
+""".format(DWH_ROLE_ARN, LOG_JSONPATH)
+)
+
+staging_songs_manifest_copy = """
+    COPY staging_songs FROM '{{}}'
+    iam_role {}
+    json 'auto' manifest compupdate off region 'us-west-2';
+""".format(DWH_ROLE_ARN)
+
 # FINAL TABLES
 
+def match_key(title, artist, duration):
+    """
+    Returns the sql expression of the key matching an event to a song: the md5 of its lower cased title
+    and artist name and of its duration in hundredths of a second, the same for songs and events.
+    """
+    return "MD5(LOWER(TRIM({})) || '|' || LOWER(TRIM({})) || '|' || CAST(CAST(ROUND({} * 100) AS BIGINT) AS VARCHAR))".format(
+        title, artist, duration
+    )
+
+
+# song and artist of every match key of the staged songs, replaced when the songs are staged again
+song_match_table_upsert = ("""
+    DELETE FROM song_matches
+    USING staging_songs as s
+    WHERE song_matches.match_key = {song_key};
+
+    INSERT INTO song_matches (match_key, song_id, artist_id)
+    SELECT match_key, song_id, artist_id
+    FROM (
+        SELECT match_key, song_id, artist_id,
+            ROW_NUMBER() OVER (PARTITION BY match_key ORDER BY song_id) as row_rank
+        FROM (
+            SELECT {song_key} as match_key, song_id, artist_id
+            FROM staging_songs as s
+            WHERE title is not null and artist_name is not null and duration is not null
+        ) as k
+    ) as m
+    WHERE row_rank = 1;
+""").format(song_key=match_key("s.title", "s.artist_name", "s.duration"))
+
 songplay_table_insert = ("""
     INSERT INTO songplays (
         start_time,
@@ -151,20 +215,17 @@ songplay_table_insert = ("""
         e.ts,
         e.userId,
         e.level,
-        s.song_id,
-        a.artist_id,
+        m.song_id,
+        m.artist_id,
         e.sessionId,
         e.location,
         e.userAgent
     FROM staging_events as e
-    LEFT JOIN songs as s on e.song = s.title
-    LEFT JOIN artists as a on e.artist = a.name
+    JOIN song_matches as m on m.match_key = {event_key}
     WHERE 
         e.ts is not null and
-        e.userId is not null and
-        s.song_id is not null and
-        a.artist_id is not null
-""")
+        e.userId is not null
+""").format(event_key=match_key("e.song", "e.artist", "e.length"))
 
 user_table_insert = ("""
     INSERT INTO users (user_id, first_name, last_name, gender,level)
@@ -205,12 +266,287 @@ time_table_insert = ("""
         EXTRACT(WEEKDAY FROM ts)
     FROM( 
         SELECT (TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 Second ') as ts FROM staging_events
+    ) as e
+""")
+
+# INCREMENTAL LOAD
+# staging tables only hold the new batch, every merge runs as one transaction so reruns of a batch change nothing
+
+staging_events_truncate = "TRUNCATE staging_events"
+staging_songs_truncate = "TRUNCATE staging_songs"
+
+# latest state of every user of the batch replaces the stored one
+user_table_upsert = ("""
+    DELETE FROM users
+    USING staging_events as e
+    WHERE users.user_id = e.userId;
+
+    INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT userId, firstName, lastName, gender, level
+    FROM (
+        SELECT userId, firstName, lastName, gender, level,
+            ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as latest
+        FROM staging_events
+        WHERE userId is not null
+    ) as e
+    WHERE latest = 1;
+""")
+
+song_table_upsert = ("""
+    DELETE FROM songs
+    USING staging_songs as s
+    WHERE songs.song_id = s.song_id;
+
+    INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT song_id, title, artist_id, year, duration
+    FROM (
+        SELECT song_id, title, artist_id, year, duration,
+            ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY title) as row_rank
+        FROM staging_songs
+    ) as s
+    WHERE row_rank = 1;
+""")
+
+artist_table_upsert = ("""
+    DELETE FROM artists
+    USING staging_songs as s
+    WHERE artists.artist_id = s.artist_id;
+
+    INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
+    FROM (
+        SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude,
+            ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_name) as row_rank
+        FROM staging_songs
+    ) as s
+    WHERE row_rank = 1;
+""")
+
+# time attributes only depend on start_time, so known timestamps are just skipped
+time_table_upsert = ("""
+    INSERT INTO time (
+        start_time,
+        hour,
+        day,
+        week,
+        month,
+        year,
+        weekday
     )
+    SELECT DISTINCT
+        b.ts,
+        EXTRACT(HOUR FROM b.ts),
+        EXTRACT(DAY FROM b.ts),
+        EXTRACT(WEEK FROM b.ts),
+        EXTRACT(MONTH FROM b.ts),
+        EXTRACT(YEAR FROM b.ts),
+        EXTRACT(WEEKDAY FROM b.ts)
+    FROM (
+        SELECT (TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 Second ') as ts FROM staging_events
+    ) as b
+    LEFT JOIN time as t on t.start_time = b.ts
+    WHERE t.start_time is null
+""")
+
+# a songplay is a user's event at start_time in a session, only the ones not loaded yet are appended
+songplay_table_append = ("""
+    INSERT INTO songplays (
+        start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent
+    )
+    SELECT
+        e.ts,
+        e.userId,
+        e.level,
+        m.song_id,
+        m.artist_id,
+        e.sessionId,
+        e.location,
+        e.userAgent
+    FROM staging_events as e
+    JOIN song_matches as m on m.match_key = {event_key}
+    LEFT JOIN songplays as p on
+        p.start_time = e.ts and
+        p.user_id = e.userId and
+        p.session_id = e.sessionId
+    WHERE
+        e.ts is not null and
+        e.userId is not null and
+        p.start_time is null
+""").format(event_key=match_key("e.song", "e.artist", "e.length"))
+
+# SUMMARY TABLES
+# plays per hour and per day kept next to songplays so analysts don't scan the fact table. Only the hours and days
+# of the staged events are deleted and counted again from songplays, so full, incremental and swap loads keep them
+# in line with songplays while reading just the batch
+
+def time_bucket(grain, ms):
+    """
+    Returns the sql expression of the start of the hour or day of a time in milliseconds since epoch.
+    """
+    return "DATE_TRUNC('{}', TIMESTAMP 'epoch' + {}/1000 * INTERVAL '1 Second ')".format(grain, ms)
+
+
+def touched_buckets_select(grain):
+    """
+    Returns the query of the distinct hours or days of the staged events, the ones the latest load touched.
+    """
+    return "SELECT DISTINCT {} as bucket FROM staging_events WHERE ts is not null".format(time_bucket(grain, "ts"))
+
+
+def batch_range(margin):
+    """
+    Returns the condition keeping the songplays between the first and last staged events, widened by margin
+    milliseconds to whole hours or days. start_time is the sort key, so Redshift skips the blocks outside of it.
+    """
+    return "start_time between (SELECT MIN(ts) FROM staging_events) - {margin} and (SELECT MAX(ts) FROM staging_events) + {margin}".format(
+        margin=margin
+    )
+
+
+hourly_plays_refresh = ("""
+    DELETE FROM hourly_plays
+    USING ({touched}) as b
+    WHERE hourly_plays.hour_start = b.bucket;
+
+    INSERT INTO hourly_plays (hour_start, level, location, plays)
+    SELECT p.hour_start, p.level, p.location, COUNT(*)
+    FROM (
+        SELECT {play_hour} as hour_start, level, location
+        FROM songplays
+        WHERE {batch_range}
+    ) as p
+    JOIN ({touched}) as b on b.bucket = p.hour_start
+    GROUP BY p.hour_start, p.level, p.location;
+""").format(touched=touched_buckets_select("hour"), play_hour=time_bucket("hour", "start_time"), batch_range=batch_range(3600000))
+
+daily_song_plays_refresh = ("""
+    DELETE FROM daily_song_plays
+    USING ({touched}) as b
+    WHERE daily_song_plays.day_start = b.bucket;
+
+    INSERT INTO daily_song_plays (day_start, song_id, artist_id, plays)
+    SELECT p.day_start, p.song_id, p.artist_id, COUNT(*)
+    FROM (
+        SELECT {play_day} as day_start, song_id, artist_id
+        FROM songplays
+        WHERE {batch_range}
+    ) as p
+    JOIN ({touched}) as b on b.bucket = p.day_start
+    GROUP BY p.day_start, p.song_id, p.artist_id;
+""").format(touched=touched_buckets_select("day"), play_day=time_bucket("day", "start_time"), batch_range=batch_range(86400000))
+
+# EXPORT
+# star schema as exported to parquet by export.py, with the partition columns of the Data-Lake layout last
+
+EXPORT_USERS_BUCKETS = config.getint("EXPORT", "USERS_BUCKETS", fallback=64)
+
+songplay_table_export = ("""
+    SELECT songplay_id, TIMESTAMP 'epoch' + start_time/1000 * INTERVAL '1 Second ' as start_time, user_id, level, song_id,
+        artist_id, session_id, location, user_agent,
+        EXTRACT(YEAR FROM TIMESTAMP 'epoch' + start_time/1000 * INTERVAL '1 Second ') as year,
+        EXTRACT(MONTH FROM TIMESTAMP 'epoch' + start_time/1000 * INTERVAL '1 Second ') as month
+    FROM songplays
+""")
+
+time_table_export = ("""
+    SELECT start_time, hour, day, week, weekday, year, month
+    FROM time
+""")
+
+user_table_export = ("""
+    SELECT user_id, first_name, last_name, gender, level, user_id % {} as user_bucket
+    FROM users
+""").format(EXPORT_USERS_BUCKETS)
+
+song_table_export = ("""
+    SELECT song_id, title, artist_id, duration, year
+    FROM songs
+""")
+
+artist_table_export = ("""
+    SELECT artist_id, name, location, latitude, longitude
+    FROM artists
+""")
+
+# year and month of the events of the latest load, the partitions of songplays and time it touched
+touched_partitions_select = ("""
+    SELECT DISTINCT EXTRACT(YEAR FROM e.ts) as year, EXTRACT(MONTH FROM e.ts) as month
+    FROM (
+        SELECT (TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 Second ') as ts FROM staging_events WHERE ts is not null
+    ) as e
+    ORDER BY year, month
 """)
 
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, song_match_table_create, hourly_plays_table_create, daily_song_plays_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, song_match_table_drop, hourly_plays_table_drop, daily_song_plays_table_drop]
 copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert, time_table_insert, songplay_table_insert]
+insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert, time_table_insert, song_match_table_upsert, songplay_table_insert, hourly_plays_refresh, daily_song_plays_refresh]
+
+# output folder, query, output columns and partition columns of every exported table, the fact tables only
+# export the partitions touched by the latest load
+export_tables = [
+    ("songplays", "songplays_table.parquet", songplay_table_export,
+     ["songplay_id", "start_time", "user_id", "level", "song_id", "artist_id", "session_id", "location", "user_agent"], ["year", "month"]),
+    ("time", "time.parquet", time_table_export, ["start_time", "hour", "day", "week", "weekday"], ["year", "month"]),
+    ("users", "users.parquet", user_table_export, ["user_id", "first_name", "last_name", "gender", "level"], ["user_bucket"]),
+    ("songs", "songs.parquet", song_table_export, ["song_id", "title", "artist_id", "duration"], ["year"]),
+    ("artists", "artists.parquet", artist_table_export, ["artist_id", "name", "location", "latitude", "longitude"], []),
+]
+# songplays and time export single year/month partitions, read with a range of their start_time sort key
+# formatted with the first instant of the month and of the next one, in epoch milliseconds (ms) or as timestamps
+incremental_export_tables = {
+    "songplays": "songplays.start_time >= {start_ms} AND songplays.start_time < {end_ms}",
+    "time": "time.start_time >= '{start}' AND time.start_time < '{end}'",
+}
+
+# LOAD STEPS
+# (name, query, steps it depends on) so independent COPYs and inserts can run at the same time
+
+copy_table_steps = [
+    ("staging_events", staging_events_copy, []),
+    ("staging_songs", staging_songs_copy, []),
+]
+insert_table_steps = [
+    ("users", user_table_insert, ["staging_events"]),
+    ("songs", song_table_insert, ["staging_songs"]),
+    ("artists", artist_table_insert, ["staging_songs"]),
+    ("time", time_table_insert, ["staging_events"]),
+    ("song_matches", song_match_table_upsert, ["staging_songs"]),
+    ("songplays", songplay_table_insert, ["staging_events", "song_matches"]),
+    ("hourly_plays", hourly_plays_refresh, ["songplays"]),
+    ("daily_song_plays", daily_song_plays_refresh, ["songplays"]),
+]
+# full load steps appending to their table, which is emptied first when a targeted rerun runs them again.
+# song_matches and the summary tables already replace the rows they load
+appending_table_steps = ["staging_events", "staging_songs", "users", "songs", "artists", "time", "songplays"]
+
+# incremental mode empties the staging tables before copying the batch and merges it into the tables
+truncate_table_steps = [
+    ("truncate_staging_events", staging_events_truncate, []),
+    ("truncate_staging_songs", staging_songs_truncate, []),
+]
+upsert_table_steps = [
+    ("users", user_table_upsert, ["staging_events"]),
+    ("songs", song_table_upsert, ["staging_songs"]),
+    ("artists", artist_table_upsert, ["staging_songs"]),
+    ("time", time_table_upsert, ["staging_events"]),
+    ("song_matches", song_match_table_upsert, ["staging_songs"]),
+    ("songplays", songplay_table_append, ["staging_events", "song_matches"]),
+    ("hourly_plays", hourly_plays_refresh, ["songplays"]),
+    ("daily_song_plays", daily_song_plays_refresh, ["songplays"]),
+]
+
+# the whole batch is merged in one transaction, so a failed run leaves every table as it was
+batch_merge = "\n".join(query.strip().rstrip(";") + ";" for _, query, _ in upsert_table_steps)
+merge_table_steps = [
+    ("merge", batch_merge, ["staging_events", "staging_songs"]),
+]
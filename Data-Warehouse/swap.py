@@ -0,0 +1,94 @@
+import re
+from physical_design import create_table_sql
+from sql_queries import TABLE_COLUMNS, PHYSICAL_DESIGN
+
+
+def shadow_name(table):
+    """
+    Returns the name of the table a target is built into before the swap.
+    """
+    return table + "_shadow"
+
+
+def to_shadow(query, tables):
+    """
+    Points a query at the shadow of every table of tables, leaving other tables, such as the staging ones, as they are.
+    """
+    pattern = r"\b({})\b".format("|".join(tables))
+    return re.sub(pattern, lambda match: shadow_name(match.group(1)), query)
+
+
+def create_shadow_sql(table):
+    """
+    Returns the queries that drop the shadow of table, left over by a failed run, and create it again
+    with the columns and physical design of table.
+    """
+    shadow = shadow_name(table)
+    return "DROP TABLE IF EXISTS {};\n{}".format(shadow, create_table_sql(shadow, TABLE_COLUMNS[table], {shadow: PHYSICAL_DESIGN.get(table, {
+        "diststyle": "AUTO", "distkey": "", "sortkey": [], "encode": {}
+    })}))
+
+
+def check_shadows(cur, tables, min_row_ratio, staging=()):
+    """
+    This function raises an error when a staging table is empty, the sign of a broken COPY, or when a shadow holds
+    less than min_row_ratio of the rows of its live table, so a broken load never replaces the live tables.
+    An empty shadow built from staged rows, e.g. songplays when no event matched a song, passes like any other.
+    """
+    problems = []
+    for table in staging:
+        cur.execute("SELECT COUNT(*) FROM {}".format(table))
+        staged_rows = cur.fetchone()[0]
+        print("{:<16} {:>12} rows staged".format(table, staged_rows))
+        if staged_rows == 0:
+            problems.append("{} is empty".format(table))
+    for table in tables:
+        cur.execute("SELECT (SELECT COUNT(*) FROM {}), (SELECT COUNT(*) FROM {})".format(shadow_name(table), table))
+        shadow_rows, live_rows = cur.fetchone()
+        print("{:<16} {:>12} rows, {:>12} live".format(table, shadow_rows, live_rows))
+        if shadow_rows < live_rows * min_row_ratio:
+            problems.append("{} has {} rows against {} live".format(shadow_name(table), shadow_rows, live_rows))
+    if problems:
+        raise ValueError("Shadow tables failed the row count check, live tables were kept: " + "; ".join(problems))
+
+
+def swap_sql(tables):
+    """
+    Returns the queries that replace every live table by its shadow, meant to run in one transaction,
+    so readers see either all the old tables or all the new ones.
+    """
+    statements = []
+    for table in tables:
+        statements.append("ALTER TABLE {} RENAME TO {}_old".format(table, table))
+        statements.append("ALTER TABLE {} RENAME TO {}".format(shadow_name(table), table))
+    for table in tables:
+        statements.append("DROP TABLE {}_old".format(table))
+    return ";\n".join(statements) + ";"
+
+
+def swap_steps(copy_steps, insert_steps, min_row_ratio):
+    """
+    Returns the steps of a build and swap load:
+
+    - the staging COPYs and a shadow of every target table of insert_steps, created with its physical design
+
+    - the insert steps, pointed at the shadows
+
+    - a row count check of the shadows against the live tables
+
+    - the swap of all the targets in one transaction, committed once
+    """
+    tables = [name for name, _, _ in insert_steps]
+    # shadows are created again whenever the staging data is, since the last swap turned them into the live tables
+    staging = [name for name, _, _ in copy_steps]
+    shadow_steps = [("shadow_" + table, create_shadow_sql(table), staging) for table in tables]
+    load_steps = [
+        (name, to_shadow(query, tables), depends_on + ["shadow_" + name])
+        for name, query, depends_on in insert_steps
+    ]
+    return copy_steps + shadow_steps + load_steps + [
+        ("check_shadows", lambda cur: check_shadows(
+            cur, tables, min_row_ratio, [name for name in staging if name in TABLE_COLUMNS]
+        ), tables),
+        ("swap", swap_sql(tables), ["check_shadows"]),
+    ]
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import random
+import string
+from datetime import datetime, timedelta, timezone
+
+
+# 1x matches the sample shipped on Data-Lake/data: about 85 songs and 30 days of logs with ~8000 events
+BASE_SONGS = 85
+BASE_USERS = 100
+BASE_EVENTS_PER_DAY = 270
+DAYS = 30
+# days start at midnight UTC, so the generated ts don't depend on the timezone of the host
+START_DATE = datetime(2018, 11, 1, tzinfo=timezone.utc)
+
+OTHER_PAGES = ["Home", "Logout", "Login", "Settings", "Help", "About", "Upgrade", "Downgrade", "Save Settings"]
+WORDS = [
+    "love", "night", "heart", "fire", "dream", "rain", "blue", "home", "road", "light", "dance", "gold",
+    "summer", "city", "river", "ghost", "wild", "sky", "money", "girl", "time", "shadow", "angel", "storm",
+]
+LOCATIONS = [
+    "San Francisco-Oakland-Hayward, CA", "Phoenix-Mesa-Scottsdale, AZ", "Atlanta-Sandy Springs-Roswell, GA",
+    "New York-Newark-Jersey City, NY-NJ-PA", "Chicago-Naperville-Elgin, IL-IN-WI", "Houston-The Woodlands-Sugar Land, TX",
+]
+USER_AGENTS = [
+    "\"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+    "\"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36\"",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+FIRST_NAMES = ["Walter", "Kaylee", "Lily", "Jacob", "Tegan", "Ryan", "Chloe", "Aleena", "Jayden", "Mohammad"]
+LAST_NAMES = ["Frye", "Summers", "Koch", "Klein", "Levine", "Smith", "Cuevas", "Kirby", "Graves", "Rodriguez"]
+
+
+def random_id(rng, prefix):
+    """
+    Returns an 18 character id like the ones on song_data, e.g. SOMZWCG12A8C13C480.
+    """
+    return prefix + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+
+
+def generate_songs(rng, num_songs, title_repeat):
+    """
+    Returns song records matching song_log_schema. Artists have several songs each and title_repeat
+    of the songs reuse a title that already exists for another artist, so joins on title alone fan out.
+    """
+    num_artists = max(1, int(num_songs / 1.2))
+    artists = [{
+        "artist_id": random_id(rng, "AR"),
+        "artist_name": " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 3))),
+        "artist_location": rng.choice(LOCATIONS + [""]),
+        "artist_latitude": rng.choice([None, round(rng.uniform(-60, 60), 5)]),
+        "artist_longitude": rng.choice([None, round(rng.uniform(-150, 150), 5)]),
+    } for _ in range(num_artists)]
+
+    songs = []
+    for _ in range(num_songs):
+        if songs and rng.random() < title_repeat:
+            title = rng.choice(songs)["title"]
+        else:
+            title = " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4)))
+        song = dict(rng.choice(artists))
+        song.update({
+            "num_songs": 1,
+            "song_id": random_id(rng, "SO"),
+            "title": title,
+            "duration": round(rng.uniform(90, 420), 5),
+            "year": rng.choice([0] + list(range(1960, 2011))),
+        })
+        songs.append(song)
+    return songs
+
+
+def write_songs(songs, rng, output):
+    """
+    Writes one json file per song under output/song_data/A/B/C/TRxxxx.json, the layout of the udacity-dend bucket.
+    """
+    for song in songs:
+        track_id = random_id(rng, "TR")
+        folder = os.path.join(output, "song_data", track_id[2], track_id[3], track_id[4])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, track_id + ".json"), "w") as f:
+            json.dump(song, f)
+
+
+def zipf_weights(count, skew):
+    """
+    Returns cumulative zipf weights for count items, higher skew concentrates plays on fewer songs.
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+def generate_users(rng, num_users):
+    """
+    Returns users with their static attributes and a registration timestamp.
+    """
+    return [{
+        "userId": user_id,
+        "firstName": rng.choice(FIRST_NAMES),
+        "lastName": rng.choice(LAST_NAMES),
+        "gender": rng.choice(["M", "F"]),
+        "level": rng.choice(["free", "paid"]),
+        "location": rng.choice(LOCATIONS),
+        "userAgent": rng.choice(USER_AGENTS),
+        "registration": float(int((START_DATE - timedelta(days=rng.randint(1, 60))).timestamp() * 1000)),
+    } for user_id in range(1, num_users + 1)]
+
+
+def generate_day(rng, day, users, songs, cumulative, events_per_day, next_song_ratio, unmatched, session_counter):
+    """
+    Returns the events of one day matching event_log_schema. Events come in sessions of consecutive
+    items of a single user, NextSong events pick songs with the zipf weights and unmatched of them
+    play songs missing from the catalog. Users switch level now and then, as on the real logs.
+    """
+    events = []
+    day_start = int(day.timestamp() * 1000)
+    while len(events) < events_per_day:
+        user = rng.choice(users)
+        if rng.random() < 0.02:
+            user["level"] = "paid" if user["level"] == "free" else "free"
+        session_counter[0] += 1
+        ts = day_start + rng.randint(0, 23 * 3600 * 1000)
+        for item in range(min(int(rng.expovariate(1 / 20.0)) + 1, events_per_day - len(events))):
+            event = {
+                "artist": None, "auth": "Logged In", "firstName": user["firstName"], "gender": user["gender"],
+                "itemInSession": item, "lastName": user["lastName"], "length": None, "level": user["level"],
+                "location": user["location"], "method": "GET", "page": None, "registration": user["registration"],
+                "sessionId": session_counter[0], "song": None, "status": 200, "ts": ts,
+                "userAgent": user["userAgent"], "userId": user["userId"],
+            }
+            if rng.random() < next_song_ratio:
+                if rng.random() < unmatched:
+                    song = {
+                        "artist_name": rng.choice(WORDS).title(), "title": rng.choice(WORDS).title(),
+                        "duration": round(rng.uniform(90, 420), 5),
+                    }
+                else:
+                    song = rng.choices(songs, cum_weights=cumulative)[0]
+                event.update({
+                    "artist": song["artist_name"], "song": song["title"], "length": song["duration"],
+                    "page": "NextSong", "method": "PUT",
+                })
+                ts += int(song["duration"] * 1000)
+            else:
+                event["page"] = rng.choice(OTHER_PAGES)
+                event["status"] = rng.choice([200, 200, 307])
+                ts += rng.randint(1000, 60000)
+            events.append(event)
+    return events
+
+
+def generate(output, scale, seed=42, skew=1.1, title_repeat=0.1, next_song_ratio=0.8, unmatched=0.5):
+    """
+    Generates the song and log datasets at scale times the size of the shipped sample under output,
+    returning counts that are also stored on output/manifest.json.
+    """
+    rng = random.Random(seed)
+    songs = generate_songs(rng, int(BASE_SONGS * scale), title_repeat)
+    write_songs(songs, rng, output)
+
+    popularity = list(songs)
+    rng.shuffle(popularity)
+    cumulative = zipf_weights(len(popularity), skew)
+    users = generate_users(rng, max(1, int(BASE_USERS * scale)))
+
+    session_counter = [0]
+    num_events = 0
+    num_next_song = 0
+    for offset in range(DAYS):
+        day = START_DATE + timedelta(days=offset)
+        events = generate_day(
+            rng, day, users, popularity, cumulative, int(BASE_EVENTS_PER_DAY * scale),
+            next_song_ratio, unmatched, session_counter
+        )
+        folder = os.path.join(output, "log_data", day.strftime("%Y"), day.strftime("%m"))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, day.strftime("%Y-%m-%d-events.json")), "w") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+        num_events += len(events)
+        num_next_song += sum(1 for event in events if event["page"] == "NextSong")
+
+    manifest = {
+        "scale": scale, "seed": seed, "skew": skew, "title_repeat": title_repeat,
+        "next_song_ratio": next_song_ratio, "unmatched": unmatched,
+        "songs": len(songs), "users": len(users), "events": num_events,
+        "next_song_events": num_next_song, "sessions": session_counter[0], "log_files": DAYS,
+    }
+    with open(os.path.join(output, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    """
+    Generates a synthetic Sparkify dataset on local disk.
+    """
+    parser = argparse.ArgumentParser(description="Generates synthetic Sparkify song and log json files")
+    parser.add_argument("output")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent of song popularity")
+    parser.add_argument("--title-repeat", type=float, default=0.1, help="share of songs reusing an existing title")
+    parser.add_argument("--next-song-ratio", type=float, default=0.8, help="share of events that are song plays")
+    parser.add_argument("--unmatched", type=float, default=0.5, help="share of song plays missing from the catalog")
+    args = parser.parse_args()
+
+    manifest = generate(
+        args.output, args.scale, args.seed, args.skew, args.title_repeat, args.next_song_ratio, args.unmatched
+    )
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import configparser
+import json
+import numbers
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_WAREHOUSE = os.path.join(ROOT, "Data-Warehouse")
+
+
+def analyst_queries():
+    """
+    Returns the analyst queries as (name, query on songplays, same query on the summary tables).
+    Both queries of a pair return the same rows.
+    """
+    from sql_queries import time_bucket
+    return [
+        (
+            "plays_per_hour",
+            """
+            SELECT hour_start, COUNT(*) as plays
+            FROM (SELECT {} as hour_start FROM songplays) as p
+            GROUP BY hour_start
+            ORDER BY hour_start
+            """.format(time_bucket("hour", "start_time")),
+            """
+            SELECT hour_start, SUM(plays) as plays
+            FROM hourly_plays
+            GROUP BY hour_start
+            ORDER BY hour_start
+            """,
+        ),
+        (
+            "top_songs_per_day",
+            """
+            SELECT day_start, song_id, plays
+            FROM (
+                SELECT day_start, song_id, COUNT(*) as plays,
+                    ROW_NUMBER() OVER (PARTITION BY day_start ORDER BY COUNT(*) DESC, song_id) as row_rank
+                FROM (SELECT {} as day_start, song_id FROM songplays) as p
+                GROUP BY day_start, song_id
+            ) as d
+            WHERE row_rank <= 10
+            ORDER BY day_start, row_rank
+            """.format(time_bucket("day", "start_time")),
+            """
+            SELECT day_start, song_id, plays
+            FROM (
+                SELECT day_start, song_id, SUM(plays) as plays,
+                    ROW_NUMBER() OVER (PARTITION BY day_start ORDER BY SUM(plays) DESC, song_id) as row_rank
+                FROM daily_song_plays
+                GROUP BY day_start, song_id
+            ) as d
+            WHERE row_rank <= 10
+            ORDER BY day_start, row_rank
+            """,
+        ),
+        (
+            "plays_by_level_location",
+            """
+            SELECT level, location, COUNT(*) as plays
+            FROM songplays
+            GROUP BY level, location
+            ORDER BY level, location
+            """,
+            """
+            SELECT level, location, SUM(plays) as plays
+            FROM hourly_plays
+            GROUP BY level, location
+            ORDER BY level, location
+            """,
+        ),
+    ]
+
+
+def normalize(rows):
+    """
+    Returns rows with counts as python ints, since COUNT and SUM return different number types.
+    """
+    return [tuple(int(value) if isinstance(value, numbers.Number) else value for value in row) for row in rows]
+
+
+def time_query(cur, query, repeat):
+    """
+    Runs a query repeat times and returns the median time in milliseconds and the rows of the last run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        cur.execute(query)
+        rows = cur.fetchall()
+        timings.append((time.time() - start) * 1000)
+    return statistics.median(timings), rows
+
+
+def benchmark(pool, backend, repeat, results_path):
+    """
+    - Runs every analyst query against songplays and against the summary tables, repeat times each
+
+    - Appends one json line per query with both median times, the speedup and whether both returned the same rows
+      to results_path
+
+    - Returns the results
+    """
+    from backends import translate
+    results = []
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM songplays")
+            fact_rows = cur.fetchone()[0]
+            for name, raw_query, summary_query in analyst_queries():
+                raw_ms, raw_rows = time_query(cur, translate(raw_query, backend), repeat)
+                summary_ms, summary_rows = time_query(cur, translate(summary_query, backend), repeat)
+                result = {
+                    "run_at": datetime.utcnow().isoformat(), "backend": backend, "query": name,
+                    "fact_rows": fact_rows, "rows": len(raw_rows),
+                    "raw_ms": round(raw_ms, 3), "summary_ms": round(summary_ms, 3),
+                    "speedup": round(raw_ms / summary_ms, 1) if summary_ms else None,
+                    "same_rows": normalize(raw_rows) == normalize(summary_rows),
+                }
+                results.append(result)
+                with open(results_path, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+    return results
+
+
+def print_results(results):
+    """
+    Prints the results as a table.
+    """
+    print("{:<24} {:>10} {:>8} {:>10} {:>12} {:>8} {:>10}".format(
+        "query", "fact rows", "rows", "raw ms", "summary ms", "speedup", "same rows"))
+    for result in results:
+        print("{:<24} {:>10} {:>8} {:>10} {:>12} {:>8} {:>10}".format(
+            result["query"], result["fact_rows"], result["rows"], result["raw_ms"], result["summary_ms"],
+            result["speedup"] if result["speedup"] is not None else "-", "yes" if result["same_rows"] else "no"))
+
+
+def main():
+    """
+    Compares the latency of the analyst queries on songplays with the same queries on the summary tables,
+    on a Data-Warehouse database loaded by etl.py or by the warehouse_duckdb stage of run_benchmarks.py.
+    """
+    parser = argparse.ArgumentParser(description="Compares analyst query latency on songplays and on the summary tables")
+    parser.add_argument("--backend", choices=["redshift", "duckdb", "postgres"], default="duckdb")
+    parser.add_argument("--database", help="duckdb file, e.g. benchmark-data/output-10x/sparkify.duckdb, "
+                                           "instead of DUCKDB_PATH of Data-Warehouse/dwh.cfg")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--results", default="query-latency.jsonl")
+    args = parser.parse_args()
+
+    results_path = os.path.abspath(args.results)
+    database = os.path.abspath(args.database) if args.database else None
+    # sql_queries reads dwh.cfg from the working directory
+    os.chdir(DATA_WAREHOUSE)
+    sys.path.insert(0, DATA_WAREHOUSE)
+    from backends import connection_pool
+
+    config = configparser.ConfigParser()
+    config.read("dwh.cfg")
+    if database:
+        config.set("LOCAL", "DUCKDB_PATH", database)
+    pool = connection_pool(config, args.backend, 1)
+    try:
+        print_results(benchmark(pool, args.backend, args.repeat, results_path))
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
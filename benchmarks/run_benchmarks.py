@@ -0,0 +1,205 @@
+import argparse
+import configparser
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from generate_data import generate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_LAKE = os.path.join(ROOT, "Data-Lake")
+DATA_WAREHOUSE = os.path.join(ROOT, "Data-Warehouse")
+
+
+def lake_layouts():
+    """
+    Returns the Data-Lake table layouts from Data-Lake/dl.cfg.
+    """
+    from writer import load_layouts
+    config = configparser.ConfigParser()
+    config.read(os.path.join(DATA_LAKE, "dl.cfg"))
+    return load_layouts(config)
+
+
+def lake_local_songs(input_data, output_data):
+    """
+    Runs the song stage of the Data-Lake local engine.
+    """
+    import local_etl
+    local_etl.process_song_data(input_data, output_data, lake_layouts())
+
+
+def lake_local_logs(input_data, output_data):
+    """
+    Runs the log stage of the Data-Lake local engine with the song lookup written by lake_local_songs.
+    """
+    import pyarrow.parquet as pq
+    import local_etl
+    song_lookup = pq.read_table(output_data + "song_lookup.parquet")
+    local_etl.process_log_data(input_data, output_data, song_lookup, lake_layouts())
+
+
+def warehouse_duckdb(input_data, output_data):
+    """
+    Creates the Data-Warehouse tables on a duckdb database under output_data and runs the full load on it,
+    printing the time of every query.
+    """
+    import create_tables
+    import etl
+    from backends import connection_pool
+    config = configparser.ConfigParser()
+    config.read(os.path.join(DATA_WAREHOUSE, "dwh.cfg"))
+    config.set("LOCAL", "DUCKDB_PATH", os.path.join(output_data, "sparkify.duckdb"))
+    max_connections = config.getint("ETL", "MAX_CONNECTIONS", fallback=1)
+
+    pool = connection_pool(config, "duckdb", max_connections)
+    conn = pool.getconn()
+    cur = conn.cursor()
+    create_tables.drop_tables(cur, conn, "duckdb")
+    create_tables.create_tables(cur, conn, "duckdb")
+    pool.putconn(conn)
+    etl.load_tables(pool, max_connections, etl.load_steps(etl.local_copy_steps("duckdb", input_data), "full"), "duckdb")
+    pool.closeall()
+
+
+# every stage runs on its own process: in process stages have a function, the others a command.
+# rows names the manifest.json count used for rows/sec and outputs the folders whose files are counted.
+STAGES = [
+    {
+        "name": "lake_local_songs", "project": DATA_LAKE, "run": lake_local_songs,
+        "rows": "songs", "outputs": ["songs.parquet", "artists.parquet", "song_lookup.parquet"],
+    },
+    {
+        "name": "lake_local_logs", "project": DATA_LAKE, "run": lake_local_logs,
+        "rows": "events", "outputs": ["users.parquet", "time.parquet", "songplays_table.parquet"],
+    },
+    {
+        "name": "warehouse_duckdb", "project": DATA_WAREHOUSE, "run": warehouse_duckdb,
+        "rows": "events", "outputs": [],
+    },
+    {
+        "name": "lake_spark", "project": DATA_LAKE, "requires": "spark-submit",
+        "command": ["spark-submit", "etl.py", "--engine", "spark", "--input-data", "{input}", "--output-data", "{output}"],
+        "rows": "events", "outputs": [
+            "songs.parquet", "artists.parquet", "song_lookup.parquet",
+            "users.parquet", "time.parquet", "songplays_table.parquet",
+        ],
+    },
+]
+
+
+def count_files(output_data, outputs):
+    """
+    Counts the data files written on the output folders of a stage.
+    """
+    count = 0
+    for folder in outputs:
+        for _, _, files in os.walk(os.path.join(output_data, folder)):
+            count += sum(1 for name in files if not name.startswith((".", "_")))
+    return count
+
+
+def run_stage(stage, input_data, output_data):
+    """
+    Runs a stage on a child process and returns its wall time in seconds, exit code and peak resident memory in MB.
+    """
+    if "command" in stage:
+        command = [part.format(input=input_data, output=output_data) for part in stage["command"]]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage["name"], input_data, output_data]
+
+    start = time.time()
+    process = subprocess.Popen(command, cwd=stage["project"])
+    # wait4 reaps the child and returns its own resource usage, so the peak memory is per stage
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on linux
+    return elapsed, process.returncode, usage.ru_maxrss / 1024.0
+
+
+def benchmark(scales, stages, workdir, results_path):
+    """
+    - Generates the dataset of every scale under workdir, unless it was already generated
+
+    - Runs each stage on each scale and appends one json line per run to results_path
+
+    - Returns the results
+    """
+    results = []
+    for scale in scales:
+        input_data = os.path.join(workdir, "input-{}x".format(scale)) + "/"
+        if os.path.exists(os.path.join(input_data, "manifest.json")):
+            with open(os.path.join(input_data, "manifest.json")) as f:
+                counts = json.load(f)
+        else:
+            counts = generate(input_data, scale)
+
+        output_data = os.path.join(workdir, "output-{}x".format(scale)) + "/"
+        shutil.rmtree(output_data, ignore_errors=True)
+        os.makedirs(output_data)
+
+        for stage in stages:
+            result = {
+                "run_at": datetime.utcnow().isoformat(), "stage": stage["name"], "scale": scale,
+                "rows": counts[stage["rows"]],
+            }
+            if stage.get("requires") and not shutil.which(stage["requires"]):
+                result["status"] = "skipped"
+            else:
+                elapsed, returncode, peak_memory = run_stage(stage, input_data, output_data)
+                result.update({"status": "ok" if returncode == 0 else "failed", "wall_seconds": round(elapsed, 3)})
+                if returncode == 0:
+                    result.update({
+                        "rows_per_second": round(result["rows"] / elapsed, 1),
+                        "peak_memory_mb": round(peak_memory, 1),
+                        "output_files": count_files(output_data, stage["outputs"]),
+                    })
+            results.append(result)
+            with open(results_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+    return results
+
+
+def print_results(results):
+    """
+    Prints the results as a table.
+    """
+    print("{:<20} {:>7} {:>8} {:>10} {:>12} {:>12} {:>8}".format(
+        "stage", "scale", "status", "seconds", "rows/sec", "peak MB", "files"))
+    for result in results:
+        print("{:<20} {:>7} {:>8} {:>10} {:>12} {:>12} {:>8}".format(
+            result["stage"], result["scale"], result["status"], result.get("wall_seconds", "-"),
+            result.get("rows_per_second", "-"), result.get("peak_memory_mb", "-"), result.get("output_files", "-")))
+
+
+def main():
+    """
+    Runs the scaling benchmark, or a single in process stage when called with --run-stage by the benchmark itself.
+    """
+    parser = argparse.ArgumentParser(description="Runs each ETL stage over synthetic data at several scales")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--stages", nargs="+", default=[stage["name"] for stage in STAGES])
+    parser.add_argument("--workdir", default="benchmark-data")
+    parser.add_argument("--results", default="benchmark-results.jsonl")
+    parser.add_argument("--run-stage", nargs=3, metavar=("STAGE", "INPUT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        name, input_data, output_data = args.run_stage
+        sys.path.insert(0, os.getcwd())
+        next(stage for stage in STAGES if stage["name"] == name)["run"](input_data, output_data)
+        return
+
+    workdir = os.path.abspath(args.workdir)
+    stages = [stage for stage in STAGES if stage["name"] in args.stages]
+    results = benchmark([int(scale) if scale.is_integer() else scale for scale in args.scales], stages, workdir, os.path.abspath(args.results))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()